@@ -1,39 +1,289 @@
+import time
+import threading
 import requests
+from collections import OrderedDict
 from requests.auth import HTTPBasicAuth
+from doc_ids import alias_doc_id, canonical_alias_key, normalize_alias_name
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD, get_session
 
-COUCHDB_URL = "http://9.20.195.22:5984"
 DB_NAME = "user_aliases"
-USERNAME = "admin"
-PASSWORD = "admin123"
+USERNAME = COUCHDB_USER
+PASSWORD = COUCHDB_PASSWORD
+
+# How many alias names the in-process cache keeps, and how often (seconds) it
+# polls the _changes feed for edits made through the alias mapper UI.
+ALIAS_CACHE_MAX_ENTRIES = 50000
+ALIAS_CACHE_REFRESH_INTERVAL = 30
+# Keys per keyed _all_docs / view request when resolving names in bulk
+ALIAS_LOOKUP_CHUNK_SIZE = 1000
+# user_aliases view keyed on the stored canonical_key (see couchdb_schema.REQUIRED_VIEWS)
+CANONICAL_KEY_VIEW = "_design/aliases/_view/by_canonical_key"
+
+
+# ✅ In-process alias cache: one bulk read of user_aliases, kept fresh via _changes
+class AliasResolver:
+    """Resolves Salesforce alias names to primary account names from memory.
+
+    The whole ``user_aliases`` table is loaded with a single ``_all_docs`` read
+    and then followed through the ``_changes`` feed from the stored ``since``
+    sequence. Names are matched on their normalized form (the same key the
+    ``alias:<name>`` document IDs use) and, failing that, on their canonical key
+    (``doc_ids.canonical_alias_key``), so "ACME Corp." finds the mapping of
+    "Acme Corporation"; a canonical key shared by mappings of different accounts
+    resolves nothing. When the table is larger than ``max_entries`` the cache
+    keeps the most recently used names and reads misses by document ID and
+    through the ``by_canonical_key`` view.
+    """
+
+    def __init__(self, couchdb_url=COUCHDB_URL, db_name=DB_NAME, username=USERNAME, password=PASSWORD,
+                 max_entries=ALIAS_CACHE_MAX_ENTRIES, refresh_interval=ALIAS_CACHE_REFRESH_INTERVAL):
+        self.db_url = f"{couchdb_url}/{db_name}"
+        self.auth = HTTPBasicAuth(username, password)
+        self.session = get_session()
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self._names = OrderedDict()  # normalized salesforce_name -> (user_name or None, doc_id)
+        self._doc_names = {}  # doc_id -> normalized salesforce_name, so renames and deletes can be undone
+        self._canonical = {}  # canonical key -> {doc_id: user_name or None}
+        self._since = None
+        self._complete = False
+        self._last_refresh = 0.0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.canonical_hits = 0
+        self.refreshes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "canonical_hits": self.canonical_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "size": len(self._names),
+            "complete": self._complete,
+        }
+
+    def _store(self, alias_name, user_name, doc_id):
+        previous = self._names.get(alias_name)
+        if previous is not None and previous[1] != doc_id:
+            # Legacy duplicates (migration collisions) share a normalized name; the last one read owns it
+            self._doc_names.pop(previous[1], None)
+            self._drop_canonical(alias_name, previous[1])
+        self._names[alias_name] = (user_name, doc_id)
+        self._names.move_to_end(alias_name)
+        self._doc_names[doc_id] = alias_name
+        self._canonical.setdefault(canonical_alias_key(alias_name), {})[doc_id] = user_name
+        while len(self._names) > self.max_entries:
+            evicted_name, (_, evicted_id) = self._names.popitem(last=False)
+            self._doc_names.pop(evicted_id, None)
+            self._drop_canonical(evicted_name, evicted_id)
+            self._complete = False
+
+    def _drop_canonical(self, alias_name, doc_id):
+        key = canonical_alias_key(alias_name)
+        owners = self._canonical.get(key, {})
+        owners.pop(doc_id, None)
+        if not owners:
+            self._canonical.pop(key, None)
+
+    def _apply_doc(self, doc_id, doc):
+        # Drop whatever name this document used to carry (renames and deletes)
+        old_name = self._doc_names.pop(doc_id, None)
+        if old_name is not None:
+            self._drop_canonical(old_name, doc_id)
+            if self._names.get(old_name, (None, None))[1] == doc_id:
+                del self._names[old_name]
+        if doc is None or doc.get("_deleted"):
+            return
+        alias_name = normalize_alias_name(doc.get("salesforce_name"))
+        if alias_name:
+            user_name = (doc.get("user_name") or "").strip()
+            self._store(alias_name, user_name or None, doc_id)
+
+    def _cached(self, alias_name):
+        """``(True, primary name)`` when the cache can answer for the normalized ``alias_name``."""
+        cached = self._names.get(alias_name)
+        if cached is not None:
+            self._names.move_to_end(alias_name)
+            self.hits += 1
+            return True, cached[0]
+        owners = self._canonical.get(canonical_alias_key(alias_name))
+        primary_names = {user_name for user_name in (owners or {}).values() if user_name}
+        if len(primary_names) == 1:
+            for doc_id in owners:
+                name = self._doc_names.get(doc_id)
+                if name in self._names:
+                    self._names.move_to_end(name)
+            self.hits += 1
+            self.canonical_hits += 1
+            return True, primary_names.pop()
+        return False, None
+
+    def preload(self):
+        """Loads every salesforce_name -> user_name pair in one bulk read."""
+        with self._lock:
+            info = self.session.get(self.db_url, auth=self.auth)
+            info.raise_for_status()
+            since = info.json().get("update_seq")
+
+            response = self.session.get(f"{self.db_url}/_all_docs", params={"include_docs": "true"}, auth=self.auth)
+            response.raise_for_status()
+            self._names.clear()
+            self._doc_names.clear()
+            self._canonical.clear()
+            self._complete = True
+            for row in response.json().get("rows", []):
+                self._apply_doc(row["id"], row.get("doc"))
+
+            # Anything written between the update_seq read and the bulk read is replayed here
+            self._since = since
+            self._last_refresh = 0.0
+            self.refresh()
+
+    def refresh(self):
+        """Applies the _changes feed since the last stored sequence."""
+        with self._lock:
+            while True:
+                params = {"since": self._since, "include_docs": "true", "limit": 1000}
+                response = self.session.get(f"{self.db_url}/_changes", params=params, auth=self.auth)
+                response.raise_for_status()
+                result = response.json()
+                changes = result.get("results", [])
+                for change in changes:
+                    doc = None if change.get("deleted") else change.get("doc")
+                    self._apply_doc(change["id"], doc)
+                self._since = result.get("last_seq", self._since)
+                if len(changes) < params["limit"]:
+                    break
+            self._last_refresh = time.monotonic()
+            self.refreshes += 1
+
+    def _ensure_fresh(self, force=False):
+        try:
+            if self._since is None:
+                self.preload()
+            elif force or time.monotonic() - self._last_refresh >= self.refresh_interval:
+                self.refresh()
+        except requests.exceptions.RequestException as e:
+            # Serve what we have (or fall through to a keyed read) if CouchDB is briefly unreachable
+            print(f"Error refreshing alias cache: {e}")
+
+    def _fetch(self, alias_names):
+        """Loads the mappings of normalized ``alias_names`` into the cache; returns ``{name: primary name}``.
+
+        The answers are returned as well as cached, since a batch larger than
+        ``max_entries`` evicts its own first names. Each chunk is read by document ID, which finds exact matches whether or not
+        the document has a canonical_key yet, and through the ``by_canonical_key``
+        view for the canonical matches (skipped while the view does not exist).
+        """
+        primary = {}
+        for start in range(0, len(alias_names), ALIAS_LOOKUP_CHUNK_SIZE):
+            chunk = alias_names[start:start + ALIAS_LOOKUP_CHUNK_SIZE]
+            keys = [alias_doc_id(name) for name in chunk]
+            response = self.session.post(f"{self.db_url}/_all_docs", json={"keys": keys, "include_docs": True}, auth=self.auth)
+            response.raise_for_status()
+            rows = response.json().get("rows", [])
+
+            keys = sorted({canonical_alias_key(name) for name in chunk})
+            response = self.session.post(f"{self.db_url}/{CANONICAL_KEY_VIEW}", json={"keys": keys},
+                                         params={"include_docs": "true"}, auth=self.auth)
+            if response.status_code != 404:
+                response.raise_for_status()
+                rows += response.json().get("rows", [])
+            exact, canonical = {}, {}
+            for row in rows:
+                doc = row.get("doc")
+                if not doc:
+                    continue
+                self._apply_doc(row["id"], doc)
+                user_name = (doc.get("user_name") or "").strip() or None
+                exact[normalize_alias_name(doc.get("salesforce_name"))] = user_name
+                if user_name:
+                    canonical.setdefault(canonical_alias_key(doc.get("salesforce_name")), set()).add(user_name)
+            for name in chunk:
+                if name in exact:
+                    primary[name] = exact[name]
+                elif len(canonical.get(canonical_alias_key(name), ())) == 1:
+                    primary[name] = next(iter(canonical[canonical_alias_key(name)]))
+        return primary
+
+    def lookup_many(self, alias_names, fresh=False):
+        """Resolves many names at once; returns ``({input name: primary name}, [input names without one])``.
+
+        Inputs are normalized and deduplicated; the names the cache cannot answer
+        are read with one keyed ``_all_docs`` and one keyed view request per
+        ALIAS_LOOKUP_CHUNK_SIZE names. ``fresh`` applies the pending _changes
+        first instead of waiting for the refresh interval.
+        """
+        by_name = {}
+        for alias_name in dict.fromkeys(alias_names):
+            by_name.setdefault(normalize_alias_name(alias_name), []).append(alias_name)
+        by_name.pop("", None)
+
+        with self._lock:
+            self._ensure_fresh(force=fresh)
+            primary = {}
+            to_fetch = []
+            for name in by_name:
+                found, primary[name] = self._cached(name)
+                if not found:
+                    self.misses += 1
+                    if not self._complete:
+                        to_fetch.append(name)
+            if to_fetch:
+                try:
+                    primary.update(self._fetch(to_fetch))
+                except requests.exceptions.RequestException as e:
+                    print(f"Error fetching primary names for {len(to_fetch)} aliases: {e}")
+
+        resolved, misses = {}, []
+        for name, inputs in by_name.items():
+            for alias_name in inputs:
+                if primary.get(name):
+                    resolved[alias_name] = primary[name]
+                else:
+                    misses.append(alias_name)
+        return resolved, misses
+
+    def lookup(self, alias_name):
+        alias_name = normalize_alias_name(alias_name)
+        if not alias_name:
+            return None
+
+        with self._lock:
+            self._ensure_fresh()
+
+            found, primary_name = self._cached(alias_name)
+            if found:
+                return primary_name
+            self.misses += 1
+            if self._complete:
+                return None
+
+            try:
+                return self._fetch([alias_name]).get(alias_name)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching primary name for '{alias_name}': {e}")
+                return None
+
+
+_resolver = AliasResolver()
+
+
+def get_alias_resolver():
+    return _resolver
+
 
 # ✅ Fetch Primary Account Name using Alias Account Name (returns instead of prints)
 def fetch_primary_name(alias_name: str):
-    alias_name = alias_name.strip()
-    if not alias_name:
-        return None
-
-    url = f"{COUCHDB_URL}/{DB_NAME}/_find"
-    query = {
-        "selector": {"salesforce_name": alias_name},
-        "fields": ["user_name"]
-    }
-
-    try:
-        response = requests.post(url, json=query, auth=HTTPBasicAuth(USERNAME, PASSWORD))
-        response.raise_for_status()
-        result = response.json()
-
-        docs = result.get("docs", [])
-        if not docs:
-            return None
+    return _resolver.lookup(alias_name)
 
-        # ✅ Return the primary account name
-        primary_name = docs[0].get("user_name", "").strip()
-        return primary_name if primary_name else None
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching primary name for '{alias_name}': {e}")
-        return None
+# ✅ Resolve a whole column of alias names in one go
+def fetch_primary_names(alias_names, fresh=False):
+    """Returns ``({alias name: primary name}, [alias names without a mapping])`` for ``alias_names``."""
+    return _resolver.lookup_many(alias_names, fresh=fresh)
 
 
 # ✅ Run interactively only if this file is executed directly
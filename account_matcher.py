@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict, defaultdict
+import requests
+from requests.auth import HTTPBasicAuth
+from couchdb_client import get_session, iter_view_rows
+
+log = logging.getLogger(__name__)
+
+# Minimum TF-IDF cosine score for a fuzzy match to be used in place of an alias lookup
+FUZZY_MATCH_MIN_SCORE = 0.5
+# Distinct names whose best match an AccountMatcher remembers; a warm matcher lives as long as the watcher
+FUZZY_MATCH_MEMO_SIZE = 10000
+_UNSCORED = object()
+
+# Persisted keyword statistics of the account master (see AccountKeywordStats)
+ACCOUNT_DB_NAME = "per_account_distribution_sheet_master"
+ACCOUNT_KEYWORDS_FILE = os.environ.get("ACCOUNT_KEYWORDS_FILE", "account_keywords.json")
+ACCOUNT_KEYWORDS_VERSION = 1
+# Rebuild from a full download instead of replaying _changes when more than this
+# share of the stored accounts changed since the artifact was written
+ACCOUNT_KEYWORDS_REBUILD_RATIO = 0.25
+
+
+# Step 2: Auto-detect ignore words
+def _name_words(name):
+    """Words and trailing words of one account name, as counted by build_ignore_words."""
+    words = re.split(r'\W+', name.lower())
+    return words, [word for word in words[-3:] if word]
+
+
+def ignore_words_from_counts(word_counter, suffix_counter, total_names):
+    ignore_words = set()
+    for word, count in word_counter.items():
+        if not word:
+            continue
+        frequency = count / total_names
+        if len(word) <= 3 or frequency > 0.4:
+            ignore_words.add(word)
+    for word, count in suffix_counter.items():
+        if count > 2:
+            ignore_words.add(word)
+    return ignore_words
+
+
+def build_ignore_words(account_names):
+    word_counter = Counter()
+    suffix_counter = Counter()
+    for name in account_names:
+        words, suffixes = _name_words(name)
+        word_counter.update(words)
+        suffix_counter.update(suffixes)
+    return ignore_words_from_counts(word_counter, suffix_counter, len(account_names))
+
+
+# Step 3: Clean keywords
+def clean_keywords(text, ignore_words):
+    words = re.split(r'\W+', text.lower())
+    return [word for word in words if word and word not in ignore_words]
+
+
+# ✅ Keyword index over the account master, built once per run
+class AccountMatcher:
+    """Fuzzy matches free-text account names against the known accounts.
+
+    Every account name is tokenized once with ``clean_keywords`` into an inverted
+    index (keyword -> accounts). A query only looks at the accounts sharing at
+    least one keyword with it, ranked by the TF-IDF cosine of their keyword sets,
+    so rare keywords weigh more than ones many accounts carry.
+    """
+
+    def __init__(self, account_names, ignore_words=None):
+        self.account_names = list(dict.fromkeys(account_names))
+        self.ignore_words = build_ignore_words(self.account_names) if ignore_words is None else ignore_words
+        self._keywords = [set(clean_keywords(name, self.ignore_words)) for name in self.account_names]
+        self._index = defaultdict(list)
+        for position, keywords in enumerate(self._keywords):
+            for keyword in keywords:
+                self._index[keyword].append(position)
+        total = len(self.account_names)
+        self._idf = {keyword: math.log(1 + total / len(positions)) for keyword, positions in self._index.items()}
+        self._norms = [math.sqrt(sum(self._idf[k] ** 2 for k in keywords)) for keywords in self._keywords]
+        self._memo = OrderedDict()  # (name, min_score) -> best match or None, least recently used first
+        self._memo_lock = threading.Lock()
+
+    def _candidates(self, keywords):
+        """Shared IDF weight per candidate account, in account order."""
+        weights = Counter()
+        for keyword in keywords:
+            weight = self._idf.get(keyword, 0.0) ** 2
+            for position in self._index.get(keyword, ()):
+                weights[position] += weight
+        return sorted(weights.items())
+
+    def match(self, name, limit=5):
+        """Ranked ``(account_name, score, matched_keywords, status)`` candidates for ``name``."""
+        keywords = list(dict.fromkeys(clean_keywords(name, self.ignore_words)))
+        if not keywords:
+            return []
+        primary_keyword = keywords[0]
+        query_norm = math.sqrt(sum(self._idf.get(k, 0.0) ** 2 for k in keywords))
+        ranked = []
+        for position, shared in self._candidates(keywords):
+            score = shared / (query_norm * self._norms[position]) if query_norm and self._norms[position] else 0.0
+            matched = [k for k in keywords if k in self._keywords[position]]
+            status = "Closest Match" if primary_keyword in matched else "Tentative Match"
+            ranked.append((self.account_names[position], round(score, 4), matched, status))
+        ranked.sort(key=lambda candidate: candidate[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def match_many(self, names, min_score=FUZZY_MATCH_MIN_SCORE):
+        """Best match per name for a whole column, or None; the last FUZZY_MATCH_MEMO_SIZE distinct names are not scored again."""
+        results = []
+        for name in names:
+            key = (str(name), min_score)
+            with self._memo_lock:
+                best = self._memo.get(key, _UNSCORED)
+                if best is not _UNSCORED:
+                    self._memo.move_to_end(key)
+            if best is _UNSCORED:
+                ranked = self.match(str(name), limit=1)
+                best = ranked[0] if ranked and ranked[0][1] >= min_score else None
+                with self._memo_lock:
+                    self._memo[key] = best
+                    while len(self._memo) > FUZZY_MATCH_MEMO_SIZE:
+                        self._memo.popitem(last=False)
+            results.append(best)
+        return results
+
+    def best_match(self, name, min_score=FUZZY_MATCH_MIN_SCORE):
+        return self.match_many([name], min_score)[0]
+
+    def match_smart(self, excel_name):
+        """Same result shape as the original ``match_account_name_smart`` scan."""
+        excel_keywords = clean_keywords(excel_name, self.ignore_words)
+        if not excel_keywords:
+            return [], [], "Skipped (No valid keywords)"
+        primary_keyword = excel_keywords[0]
+        matched_accounts, keywords_matched = [], []
+        match_status = "Skipped (No familiar keywords)"
+        for position, _ in self._candidates(set(excel_keywords)):
+            matched = set(excel_keywords).intersection(self._keywords[position])
+            matched_accounts.append(self.account_names[position])
+            keywords_matched.append(list(matched))
+            match_status = "Closest Match" if primary_keyword in matched else "Tentative Match"
+        return matched_accounts, keywords_matched, match_status
+
+
+# ✅ Ignore-word counters kept on disk and followed through _changes
+class AccountKeywordStats:
+    """Word and suffix counters of the account master, keyed by account document.
+
+    The counters (and the ignore set derived from them) are saved as a versioned
+    JSON artifact together with the ``_changes`` sequence they reflect, so a run
+    only replays the accounts added, renamed or deleted since the last one. The
+    ignore set is exactly what ``build_ignore_words`` returns for the same names.
+    """
+
+    def __init__(self, db_name=ACCOUNT_DB_NAME):
+        self.db_name = db_name
+        self.names = {}  # account doc id -> Account Name
+        self.word_counts = Counter()
+        self.suffix_counts = Counter()
+        self.since = None
+
+    def account_names(self):
+        # Document ID order, the same order _all_docs returns them in
+        return [self.names[doc_id] for doc_id in sorted(self.names)]
+
+    def ignore_words(self):
+        return ignore_words_from_counts(self.word_counts, self.suffix_counts, len(self.names))
+
+    def apply(self, doc_id, name):
+        """Sets (or with ``name`` None removes) the Account Name of one document."""
+        old_name = self.names.pop(doc_id, None)
+        if old_name is not None:
+            for counter, removed in zip((self.word_counts, self.suffix_counts), _name_words(old_name)):
+                counter.subtract(removed)
+                for word in removed:
+                    if word in counter and counter[word] <= 0:
+                        del counter[word]
+        if name:
+            self.names[doc_id] = name
+            words, suffixes = _name_words(name)
+            self.word_counts.update(words)
+            self.suffix_counts.update(suffixes)
+
+    def to_json(self):
+        return {
+            "version": ACCOUNT_KEYWORDS_VERSION,
+            "db_name": self.db_name,
+            "since": self.since,
+            "names": self.names,
+            "word_counts": self.word_counts,
+            "suffix_counts": self.suffix_counts,
+            "ignore_words": sorted(self.ignore_words()),
+        }
+
+    def save(self, path=ACCOUNT_KEYWORDS_FILE):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, sort_keys=True, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=ACCOUNT_KEYWORDS_FILE, db_name=ACCOUNT_DB_NAME):
+        """The stored artifact, or None when it is missing, unreadable or from another version or database."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != ACCOUNT_KEYWORDS_VERSION or data.get("db_name") != db_name:
+            return None
+        stats = cls(db_name)
+        stats.names = data["names"]
+        stats.word_counts = Counter(data["word_counts"])
+        stats.suffix_counts = Counter(data["suffix_counts"])
+        stats.since = data["since"]
+        return stats
+
+
+def _account_name(doc):
+    return (doc or {}).get("Account Name", "").strip() or None
+
+
+def iter_account_rows(couchdb_url, username, password, db_name=ACCOUNT_DB_NAME):
+    """Lazily yields ``(doc_id, Account Name)`` for every account, one page at a time.
+
+    Reads the ``_design/accounts/_view/names`` projection (couchdb_schema.py) so only
+    the name crosses the network; falls back to paging ``_all_docs`` with the full
+    documents when the view has not been provisioned yet.
+    """
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+    try:
+        for row in iter_view_rows(f"{db_url}/_design/accounts/_view/names", auth=auth):
+            if row.get("value"):
+                yield row["id"], row["value"]
+        return
+    except requests.exceptions.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        log.warning(f"View '_design/accounts/_view/names' missing on '{db_name}'; reading full documents instead")
+
+    for row in iter_view_rows(f"{db_url}/_all_docs", params={"include_docs": "true"}, auth=auth):
+        name = None if row["id"].startswith("_design/") else _account_name(row.get("doc"))
+        if name:
+            yield row["id"], name
+
+
+def iter_account_names(couchdb_url, username, password, db_name=ACCOUNT_DB_NAME):
+    for _, name in iter_account_rows(couchdb_url, username, password, db_name):
+        yield name
+
+
+def _read_changes(session, db_url, auth, since, max_changes):
+    """The changes after ``since``, or None when there are more than ``max_changes``."""
+    changes = []
+    while True:
+        params = {"since": since, "include_docs": "true", "limit": 1000}
+        response = session.get(f"{db_url}/_changes", params=params, auth=auth)
+        response.raise_for_status()
+        result = response.json()
+        changes.extend(result.get("results", []))
+        since = result.get("last_seq", since)
+        if len(changes) > max_changes:
+            return None, since
+        if len(result.get("results", [])) < params["limit"]:
+            return changes, since
+
+
+def _rebuild_account_keywords(session, couchdb_url, username, password, db_name):
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+    stats = AccountKeywordStats(db_name)
+    info = session.get(db_url, auth=auth)
+    info.raise_for_status()
+    since = info.json().get("update_seq")
+
+    for doc_id, name in iter_account_rows(couchdb_url, username, password, db_name):
+        stats.apply(doc_id, name)
+
+    # Anything written between the update_seq read and the bulk read is replayed here
+    changes, stats.since = _read_changes(session, db_url, auth, since, float("inf"))
+    for change in changes:
+        if not change["id"].startswith("_design/"):
+            stats.apply(change["id"], None if change.get("deleted") else _account_name(change.get("doc")))
+    return stats
+
+
+def load_account_keywords(couchdb_url, username, password, db_name=ACCOUNT_DB_NAME, path=ACCOUNT_KEYWORDS_FILE):
+    """Brings the stored keyword statistics up to date and returns them.
+
+    Only the ``_changes`` since the stored sequence are downloaded; the full
+    account table is read again when there is no usable artifact, when CouchDB no
+    longer accepts its sequence, or when more than ACCOUNT_KEYWORDS_REBUILD_RATIO
+    of the accounts changed.
+    """
+    session = get_session()
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+
+    stats = AccountKeywordStats.load(path, db_name)
+    changes = None
+    if stats is not None:
+        max_changes = max(100, int(len(stats.names) * ACCOUNT_KEYWORDS_REBUILD_RATIO))
+        try:
+            changes, since = _read_changes(session, db_url, auth, stats.since, max_changes)
+        except Exception as e:
+            log.warning(f"Could not replay account changes since the stored sequence: {e}")
+
+    if changes is None:
+        log.info(f"Rebuilding account keyword statistics from '{db_name}'")
+        stats = _rebuild_account_keywords(session, couchdb_url, username, password, db_name)
+    elif changes or since != stats.since:
+        for change in changes:
+            if not change["id"].startswith("_design/"):
+                stats.apply(change["id"], None if change.get("deleted") else _account_name(change.get("doc")))
+        stats.since = since
+        log.info(f"Applied {len(changes)} account changes to the keyword statistics")
+    else:
+        return stats
+
+    try:
+        stats.save(path)
+    except OSError as e:
+        log.warning(f"Could not save account keyword statistics to '{path}': {e}")
+    return stats
@@ -0,0 +1,374 @@
+"""In-process fake of the CouchDB HTTP API subset the pipeline uses.
+
+Supports database create/info/delete, document GET/PUT/DELETE/HEAD, ``_find``
+(``$eq``/``$in``/``$gt``/``$exists``), ``_explain``, ``_index``, ``_all_docs``
+(keys, key ranges, paging; one row per line like CouchDB), ``_bulk_docs``,
+``_changes``, ``_local`` documents and views (GET, or POST with ``keys``) whose map
+functions are registered in Python. Every request can be delayed by ``latency`` seconds to model a
+network round trip, and ``request_counts`` tallies calls per method and endpoint.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+
+class _Database:
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+        self.local_docs = {}
+        self.seq = 0
+        self.changes = {}
+        self.indexes = []
+
+    def _bump(self, doc_id, deleted):
+        self.seq += 1
+        self.changes.pop(doc_id, None)
+        self.changes[doc_id] = (self.seq, deleted)
+
+    def put(self, doc, new_edits=True):
+        doc = dict(doc)
+        doc_id = doc.get("_id") or uuid.uuid4().hex
+        current = self.docs.get(doc_id)
+        if new_edits:
+            if current is not None and doc.get("_rev") != current["_rev"]:
+                return None, "conflict"
+            if current is None and doc.get("_rev") and not doc.get("_deleted"):
+                return None, "conflict"
+            generation = int(current["_rev"].split("-")[0]) + 1 if current else 1
+            doc["_rev"] = f"{generation}-{uuid.uuid4().hex}"
+        doc["_id"] = doc_id
+        if doc.get("_deleted"):
+            if current is None:
+                return None, "not_found"
+            del self.docs[doc_id]
+            self._bump(doc_id, True)
+            return doc, None
+        self.docs[doc_id] = doc
+        self._bump(doc_id, False)
+        return doc, None
+
+
+def _match(doc, selector):
+    for field, cond in selector.items():
+        if field == "$and":
+            if not all(_match(doc, sub) for sub in cond):
+                return False
+            continue
+        if field == "$or":
+            if not any(_match(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            for op, arg in cond.items():
+                if op == "$eq" and value != arg:
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$exists" and (field in doc) != arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _collate_key(value):
+    return (value is None, value)
+
+
+class FakeCouchDB:
+    """In-process stand-in for the subset of the CouchDB HTTP API the pipeline uses."""
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.dbs = {}
+        self.views = {}
+        self.request_counts = {}
+        self.lock = threading.RLock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def register_view(self, db_name, ddoc, view, map_fn):
+        """Serves ``_design/<ddoc>/_view/<view>`` with ``map_fn(doc) -> [(key, value), ...]``."""
+        self.views[(db_name, ddoc, view)] = map_fn
+
+    def reset(self):
+        """Drops every database and the request counters."""
+        with self.lock:
+            self.dbs.clear()
+            self.request_counts.clear()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, Nagle plus the
+            # client's delayed ACK adds ~40ms to every keep-alive request
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, raw=None):
+                data = raw if raw is not None else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                return json.loads(raw) if raw else {}
+
+            def _dispatch(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                segments = [unquote(s) for s in parts.path.strip("/").split("/") if s]
+                endpoint = segments[1] if len(segments) > 1 and segments[1].startswith("_") else "doc"
+                with fake.lock:
+                    fake.request_counts[f"{self.command} {endpoint}"] = fake.request_counts.get(f"{self.command} {endpoint}", 0) + 1
+                    try:
+                        status, body, raw = self._route(segments, query)
+                    except Exception as exc:
+                        status, body, raw = 500, {"error": "internal", "reason": repr(exc)}, None
+                self._send(status, body, raw)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _dispatch
+
+            def _route(self, seg, query):
+                method = self.command
+                if not seg:
+                    return 200, {"couchdb": "Welcome", "version": "fake"}, None
+                db_name = seg[0]
+                if db_name == "_all_dbs":
+                    return 200, sorted(fake.dbs), None
+                db = fake.dbs.get(db_name)
+                if len(seg) == 1:
+                    if method == "PUT":
+                        if db is not None:
+                            return 412, {"error": "file_exists"}, None
+                        fake.dbs[db_name] = _Database(db_name)
+                        return 201, {"ok": True}, None
+                    if db is None:
+                        return 404, {"error": "not_found", "reason": "Database does not exist."}, None
+                    if method in ("GET", "HEAD"):
+                        return 200, {"db_name": db_name, "doc_count": len(db.docs), "update_seq": f"{db.seq}-fake"}, None
+                    if method == "DELETE":
+                        del fake.dbs[db_name]
+                        return 200, {"ok": True}, None
+                    if method == "POST":
+                        doc, err = db.put(self._body())
+                        if err:
+                            return 409, {"error": err}, None
+                        return 201, {"ok": True, "id": doc["_id"], "rev": doc["_rev"]}, None
+                if db is None:
+                    return 404, {"error": "not_found", "reason": "Database does not exist."}, None
+                head = seg[1]
+                if head == "_find":
+                    return self._find(db, self._body())
+                if head == "_explain":
+                    return self._explain(db, self._body())
+                if head == "_index":
+                    if method == "POST":
+                        body = self._body()
+                        fields = [next(iter(f)) if isinstance(f, dict) else f for f in body["index"]["fields"]]
+                        name = body.get("name") or "-".join(fields)
+                        for idx in db.indexes:
+                            if idx["name"] == name:
+                                return 200, {"result": "exists", "id": idx["ddoc"], "name": name}, None
+                        ddoc = "_design/" + (body.get("ddoc") or uuid.uuid4().hex)
+                        db.indexes.append({"ddoc": ddoc, "name": name, "type": "json", "def": {"fields": [{f: "asc"} for f in fields]}})
+                        db.put({"_id": ddoc, "language": "query", "views": {name: {}}})
+                        return 200, {"result": "created", "id": ddoc, "name": name}, None
+                    special = {"ddoc": None, "name": "_all_docs", "type": "special", "def": {"fields": [{"_id": "asc"}]}}
+                    return 200, {"total_rows": len(db.indexes) + 1, "indexes": [special] + db.indexes}, None
+                if head == "_all_docs":
+                    body = self._body() if method == "POST" else {}
+                    return self._all_docs(db, query, body)
+                if head == "_bulk_docs":
+                    return self._bulk_docs(db, self._body())
+                if head == "_changes":
+                    return self._changes(db, query)
+                if head == "_local":
+                    local_id = "_local/" + "/".join(seg[2:])
+                    if method == "PUT":
+                        doc = self._body()
+                        doc["_id"] = local_id
+                        doc["_rev"] = "0-1"
+                        db.local_docs[local_id] = doc
+                        return 201, {"ok": True, "id": local_id, "rev": "0-1"}, None
+                    if local_id in db.local_docs:
+                        if method == "DELETE":
+                            del db.local_docs[local_id]
+                            return 200, {"ok": True, "id": local_id, "rev": "0-0"}, None
+                        return 200, db.local_docs[local_id], None
+                    return 404, {"error": "not_found", "reason": "missing"}, None
+                if head == "_design" and len(seg) >= 5 and seg[3] == "_view":
+                    return self._view(db, seg[2], seg[4], query, self._body() if method == "POST" else {})
+                doc_id = "/".join(seg[1:])
+                if method == "PUT":
+                    doc = self._body()
+                    doc["_id"] = doc_id
+                    if "rev" in query:
+                        doc["_rev"] = query["rev"]
+                    doc, err = db.put(doc)
+                    if err:
+                        return 409, {"error": "conflict", "reason": "Document update conflict."}, None
+                    return 201, {"ok": True, "id": doc["_id"], "rev": doc["_rev"]}, None
+                current = db.docs.get(doc_id)
+                if current is None:
+                    return 404, {"error": "not_found", "reason": "missing"}, None
+                if method == "DELETE":
+                    doc, err = db.put({"_id": doc_id, "_rev": query.get("rev"), "_deleted": True})
+                    if err:
+                        return 409, {"error": "conflict", "reason": "Document update conflict."}, None
+                    return 200, {"ok": True, "id": doc_id, "rev": doc["_rev"]}, None
+                return 200, current, None
+
+            def _find(self, db, body):
+                selector = body.get("selector", {})
+                docs = [d for _, d in sorted(db.docs.items()) if not d["_id"].startswith("_design/") and _match(d, selector)]
+                docs = docs[int(body.get("skip", 0)):]
+                if "limit" in body:
+                    docs = docs[: int(body["limit"])]
+                fields = body.get("fields")
+                if fields:
+                    docs = [{f: d[f] for f in fields if f in d} for d in docs]
+                return 200, {"docs": docs}, None
+
+            def _explain(self, db, body):
+                fields = set(body.get("selector", {}))
+                for idx in db.indexes:
+                    idx_fields = [next(iter(f)) for f in idx["def"]["fields"]]
+                    if idx_fields and idx_fields[0] in fields:
+                        return 200, {"index": idx, "selector": body.get("selector")}, None
+                return 200, {"index": {"ddoc": None, "name": "_all_docs", "type": "special", "def": {"fields": [{"_id": "asc"}]}}}, None
+
+            def _rows_response(self, rows, extra=None):
+                parts = [json.dumps(r) for r in rows]
+                header = {"total_rows": extra or 0, "offset": 0}
+                raw = '{"total_rows":%d,"offset":0,"rows":[\r\n%s\r\n]}\n' % (header["total_rows"], ",\r\n".join(parts))
+                return 200, None, raw.encode()
+
+            def _all_docs(self, db, query, body):
+                include_docs = query.get("include_docs") == "true" or body.get("include_docs") is True
+                keys = body.get("keys") or (json.loads(query["keys"]) if "keys" in query else None)
+                rows = []
+                if keys is not None:
+                    for key in keys:
+                        doc = db.docs.get(key)
+                        if doc is None:
+                            change = db.changes.get(key)
+                            if change and change[1]:
+                                rows.append({"id": key, "key": key, "value": {"rev": "x", "deleted": True}, "doc": None} if include_docs else {"id": key, "key": key, "value": {"rev": "x", "deleted": True}})
+                            else:
+                                rows.append({"key": key, "error": "not_found"})
+                            continue
+                        row = {"id": key, "key": key, "value": {"rev": doc["_rev"]}}
+                        if include_docs:
+                            row["doc"] = doc
+                        rows.append(row)
+                    return self._rows_response(rows, len(db.docs))
+                ids = sorted(db.docs)
+                startkey = json.loads(query["startkey"]) if "startkey" in query else body.get("startkey")
+                endkey = json.loads(query["endkey"]) if "endkey" in query else body.get("endkey")
+                inclusive_end = query.get("inclusive_end", "true") != "false"
+                if startkey is not None:
+                    ids = [i for i in ids if i >= startkey]
+                if endkey is not None:
+                    ids = [i for i in ids if (i <= endkey if inclusive_end else i < endkey)]
+                ids = ids[int(query.get("skip", body.get("skip", 0))):]
+                limit = query.get("limit", body.get("limit"))
+                if limit is not None:
+                    ids = ids[: int(limit)]
+                for doc_id in ids:
+                    doc = db.docs[doc_id]
+                    row = {"id": doc_id, "key": doc_id, "value": {"rev": doc["_rev"]}}
+                    if include_docs:
+                        row["doc"] = doc
+                    rows.append(row)
+                return self._rows_response(rows, len(db.docs))
+
+            def _view(self, db, ddoc, view, query, body=None):
+                map_fn = fake.views.get((db.name, ddoc, view))
+                if map_fn is None:
+                    return 404, {"error": "not_found", "reason": "missing_named_view"}, None
+                rows = []
+                for doc_id, doc in db.docs.items():
+                    if doc_id.startswith("_design/"):
+                        continue
+                    for key, value in map_fn(doc):
+                        rows.append({"id": doc_id, "key": key, "value": value})
+                rows.sort(key=lambda r: (_collate_key(r["key"]), r["id"]))
+                if (body or {}).get("keys") is not None:
+                    rows = [r for key in body["keys"] for r in rows if r["key"] == key]
+                if "startkey" in query:
+                    sk = json.loads(query["startkey"])
+                    sk_id = query.get("startkey_docid")
+                    rows = [r for r in rows if (r["key"], r["id"]) >= (sk, sk_id or "")]
+                rows = rows[int(query.get("skip", 0)):]
+                if "limit" in query:
+                    rows = rows[: int(query["limit"])]
+                if query.get("include_docs") == "true":
+                    for r in rows:
+                        r["doc"] = db.docs[r["id"]]
+                return self._rows_response(rows, len(rows))
+
+            def _bulk_docs(self, db, body):
+                new_edits = body.get("new_edits", True)
+                results = []
+                for doc in body.get("docs", []):
+                    saved, err = db.put(doc, new_edits=new_edits)
+                    if err:
+                        results.append({"id": doc.get("_id"), "error": err, "reason": "Document update conflict." if err == "conflict" else "missing"})
+                    else:
+                        results.append({"ok": True, "id": saved["_id"], "rev": saved["_rev"]})
+                return 201, results, None
+
+            def _changes(self, db, query):
+                since = query.get("since", "0")
+                since_num = db.seq if since == "now" else int(str(since).split("-")[0])
+                include_docs = query.get("include_docs") == "true"
+                results = []
+                for doc_id, (seq, deleted) in sorted(db.changes.items(), key=lambda kv: kv[1][0]):
+                    if seq <= since_num:
+                        continue
+                    entry = {"seq": f"{seq}-fake", "id": doc_id, "changes": [{"rev": db.docs[doc_id]["_rev"] if not deleted else "x"}]}
+                    if deleted:
+                        entry["deleted"] = True
+                    if include_docs:
+                        entry["doc"] = db.docs.get(doc_id, {"_id": doc_id, "_deleted": True})
+                    results.append(entry)
+                if "limit" in query:
+                    results = results[: int(query["limit"])]
+                last_seq = results[-1]["seq"] if results else f"{max(since_num, 0)}-fake"
+                return 200, {"results": results, "last_seq": last_seq, "pending": 0}, None
+
+        return Handler
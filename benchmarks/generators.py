@@ -0,0 +1,55 @@
+"""Synthetic input files for the benchmarks, reproducible from a seed."""
+import random
+import datetime
+import openpyxl
+import pandas as pd
+
+# Benchmark sizes: case rows per PER workbook, alias mappings, accounts
+SIZES = {
+    "small": {"case_rows": 500, "aliases": 200, "accounts": 200},
+    "medium": {"case_rows": 5000, "aliases": 2000, "accounts": 2000},
+    "large": {"case_rows": 50000, "aliases": 20000, "accounts": 20000},
+}
+
+_WORDS = ["Acme", "Global", "Northern", "Pacific", "Atlas", "Summit", "Vertex", "Harbor", "Pioneer", "Crescent",
+          "Sterling", "Union", "Metro", "Coastal", "Highland", "Liberty", "Evergreen", "Keystone", "Apex", "Orion"]
+_SUFFIXES = ["Inc", "LLC", "Ltd", "Corporation", "Holdings", "Group", "Co"]
+
+
+def account_names(count, seed=0):
+    """``count`` distinct account names such as 'Atlas Harbor 17 Holdings'."""
+    rng = random.Random(seed)
+    return [f"{rng.choice(_WORDS)} {rng.choice(_WORDS)} {i} {rng.choice(_SUFFIXES)}" for i in range(count)]
+
+
+def alias_pairs(count, seed=0):
+    """``(Account Name, Salesforce Account Name)`` pairs; each account has one Salesforce alias."""
+    return [(name, f"{name} - Salesforce") for name in account_names(count, seed)]
+
+
+def make_alias_sheet(path, count, seed=0):
+    """Writes an AccountMapping.xlsx-style sheet with ``count`` mappings."""
+    pairs = alias_pairs(count, seed)
+    pd.DataFrame(pairs, columns=["Account Name", "Salesforce Account Name"]).to_excel(path, index=False)
+    return pairs
+
+
+def make_case_workbook(path, rows, salesforce_names, unknown_ratio=0.05, seed=0):
+    """Writes a PER export with ``rows`` cases in the column layout case_queue.CASE_COLUMNS reads.
+
+    Row 1 is the report title and row 2 the header, as in the Salesforce export;
+    ``unknown_ratio`` of the rows carry an alias with no mapping.
+    """
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["SCBN New PER report"])
+    ws.append(["#", "Account Name", "Subject", "Date/Time Opened", "", "", "", "", "", "Status",
+               "Contact Name", "Case Number", "Severity", "Mission Team"])
+    opened = datetime.datetime(2025, 1, 1, 9, 0)
+    for i in range(rows):
+        alias = f"Unmapped Customer {i}" if rng.random() < unknown_ratio else rng.choice(salesforce_names)
+        ws.append([i, alias, f"Subject {i}", opened + datetime.timedelta(minutes=7 * i), None, None, None, None, None,
+                   rng.choice(["New", "Open", "Waiting"]), f"Contact {i % 97}", 100000 + i,
+                   rng.choice(["Sev 1", "Sev 2", "Sev 3"]), rng.choice(["Team A", "Team B"])])
+    wb.save(path)
@@ -0,0 +1,270 @@
+"""Reproducible benchmarks of the alias mapper and the case pipeline against a fake CouchDB.
+
+    python benchmarks/run_benchmarks.py                    # small and medium sizes
+    python benchmarks/run_benchmarks.py --sizes large --latency 2
+    python benchmarks/run_benchmarks.py --only fetch_primary_name process_files
+
+Every run writes ``benchmarks/results/<label>.json`` (label defaults to the git
+commit and a timestamp) and compares it with the previous result file, flagging
+benchmarks that got more than ``--threshold`` slower.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.insert(0, REPO_DIR)
+
+from fake_couchdb import FakeCouchDB
+from generators import SIZES, account_names, alias_pairs, make_alias_sheet, make_case_workbook
+
+STAGE_SCRIPTS = ["per_leave_update.py", "per_account_sme.py", "per_time_spent.py", "model.py"]
+
+
+def _seed_aliases(fake, pairs):
+    from couchdb_client import get_session
+    from doc_ids import alias_doc_id, canonical_alias_key
+    docs = [{"_id": alias_doc_id(sf), "user_name": user, "salesforce_name": sf, "canonical_key": canonical_alias_key(sf),
+             "conflicts": []} for user, sf in pairs]
+    get_session().post(f"{fake.url}/user_aliases/_bulk_docs", json={"docs": docs}).raise_for_status()
+
+
+def _seed_accounts(fake, names):
+    from couchdb_client import get_session
+    from doc_ids import account_doc_id
+    docs = [{"_id": account_doc_id(name), "Account Name": name, "SME": ["sme@example.com"], "Email": []} for name in names]
+    get_session().post(f"{fake.url}/per_account_distribution_sheet_master/_bulk_docs", json={"docs": docs}).raise_for_status()
+
+
+def _fresh(fake, *db_names):
+    from couchdb_client import get_session
+    fake.reset()
+    for db_name in db_names:
+        get_session().put(f"{fake.url}/{db_name}").raise_for_status()
+
+
+def _timed(fake, fn):
+    fake.request_counts.clear()
+    start = time.perf_counter()
+    extra = fn() or {}
+    result = {"seconds": round(time.perf_counter() - start, 4), "requests": sum(fake.request_counts.values())}
+    result.update(extra)
+    return result
+
+
+# ------------------------------
+# Benchmarks
+# ------------------------------
+def bench_fetch_primary_name(fake, size, workdir):
+    from Fetching_Primary_account import AliasResolver
+    _fresh(fake, "user_aliases")
+    pairs = alias_pairs(size["aliases"])
+    _seed_aliases(fake, pairs)
+    lookups = [sf for _, sf in pairs] * max(1, size["case_rows"] // len(pairs))
+
+    resolver = AliasResolver(couchdb_url=fake.url)
+    cold = _timed(fake, lambda: {"resolved": resolver.lookup(lookups[0]) is not None})
+    warm = _timed(fake, lambda: {"lookups": len([resolver.lookup(name) for name in lookups])})
+    warm["lookups_per_second"] = round(len(lookups) / warm["seconds"], 1) if warm["seconds"] else None
+    return {"cold": cold, "warm": warm}
+
+
+def bench_process_files(fake, size, workdir):
+    import case_queue
+    import Fetching_Primary_account
+    from account_matcher import ACCOUNT_KEYWORDS_FILE
+    _fresh(fake, "user_aliases", "per_account_distribution_sheet_master")
+    pairs = alias_pairs(size["aliases"])
+    _seed_aliases(fake, pairs)
+    _seed_accounts(fake, account_names(size["accounts"]))
+    # The databases were just recreated: drop the alias cache and keyword statistics of the previous size
+    Fetching_Primary_account._resolver = Fetching_Primary_account.AliasResolver(couchdb_url=fake.url)
+    if os.path.exists(ACCOUNT_KEYWORDS_FILE):
+        os.remove(ACCOUNT_KEYWORDS_FILE)
+
+    inbox = os.path.join(workdir, "inbox")
+    os.makedirs(inbox, exist_ok=True)
+    for script in STAGE_SCRIPTS:
+        with open(os.path.join(workdir, script), "w") as f:
+            f.write("")
+    case_queue.log_dir = os.path.join(workdir, "logs")
+    # No mail relay in a benchmark: make the notification fail fast instead of resolving the relay host
+    case_queue.smtplib = types.SimpleNamespace(SMTP=lambda *args, **kwargs: (_ for _ in ()).throw(OSError("mail disabled")))
+
+    def run(label):
+        make_case_workbook(os.path.join(inbox, f"SCBN New PER-{label}.xlsx"), size["case_rows"], [sf for _, sf in pairs])
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            return _timed(fake, lambda: case_queue.process_files(
+                inbox, fake.url, "per_cases_to_triage_master", "admin", "admin") or {"rows": size["case_rows"]})
+        finally:
+            os.chdir(cwd)
+
+    initial = run("initial")
+    resync = run("resync")
+    for result in (initial, resync):
+        result["rows_per_second"] = round(size["case_rows"] / result["seconds"], 1)
+    return {"initial_load": initial, "unchanged_resync": resync}
+
+
+def bench_alias_import(fake, size, workdir):
+    import couchdb_XLSX
+    from couchdb_client import get_server
+    _fresh(fake, "user_aliases")
+    sheet = os.path.join(workdir, "AccountMapping.xlsx")
+    make_alias_sheet(sheet, size["aliases"])
+    db = get_server()["user_aliases"]
+
+    def run():
+        mapping, _ = couchdb_XLSX.read_mapping_sheet(sheet)
+        writes, deletes, outcomes = couchdb_XLSX.plan_alias_import(mapping, couchdb_XLSX.load_alias_docs(db))
+        couchdb_XLSX.commit_alias_import(db, writes, deletes, outcomes)
+        return {"rows": len(mapping), "writes": len(writes)}
+
+    return {"first_import": _timed(fake, run), "reimport": _timed(fake, run)}
+
+
+def bench_users_endpoints(fake, size, workdir):
+    _fresh(fake, "user_aliases")
+    from app import app
+    client = app.test_client()
+    pairs = alias_pairs(size["aliases"])
+
+    def create():
+        for user, sf in pairs:
+            client.post("/users", json={"user_name": user, "salesforce_name": sf})
+        return {"posts": len(pairs)}
+
+    def list_all():
+        response = client.get("/users")
+        return {"bytes": len(response.data)}
+
+    def page_through():
+        pages, cursor = 0, None
+        while True:
+            response = client.get("/users", query_string={"limit": 100, **({"cursor": cursor} if cursor else {})})
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return {"pages": pages}
+
+    def search():
+        for user, _ in pairs[:100]:
+            client.get("/users", query_string={"q": user[:6]}).get_data()
+        return {"searches": 100}
+
+    return {"create": _timed(fake, create), "list_all": _timed(fake, list_all),
+            "page_through": _timed(fake, page_through), "search": _timed(fake, search)}
+
+
+BENCHMARKS = {
+    "fetch_primary_name": bench_fetch_primary_name,
+    "process_files": bench_process_files,
+    "alias_import": bench_alias_import,
+    "users_endpoints": bench_users_endpoints,
+}
+
+
+# ------------------------------
+# Results
+# ------------------------------
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict) and "seconds" in value:
+            flat[f"{prefix}{key}"] = value["seconds"]
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+    return flat
+
+
+def compare(current, previous, threshold):
+    """Lines describing every benchmark that got more than ``threshold`` slower (or faster)."""
+    now, before = _flatten(current["results"]), _flatten(previous["results"])
+    lines = []
+    for name, seconds in sorted(now.items()):
+        if name not in before or not before[name]:
+            continue
+        ratio = seconds / before[name]
+        if ratio > 1 + threshold:
+            lines.append(f"⚠️ REGRESSION {name}: {before[name]:.3f}s -> {seconds:.3f}s ({ratio:.2f}x)")
+        elif ratio < 1 - threshold:
+            lines.append(f"✅ faster {name}: {before[name]:.3f}s -> {seconds:.3f}s ({ratio:.2f}x)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES))
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated CouchDB round trip in milliseconds")
+    parser.add_argument("--label", help="result file name (default: <commit>-<timestamp>)")
+    parser.add_argument("--baseline", help="result file to compare against (default: the previous one)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as a regression")
+    args = parser.parse_args(argv)
+
+    fake = FakeCouchDB(latency=args.latency / 1000.0).start()
+    # Point every module at the fake before any of them reads its connection settings
+    os.environ["COUCHDB_URL"] = fake.url
+    os.environ["ACCOUNT_KEYWORDS_FILE"] = os.path.join(tempfile.gettempdir(), "bench_account_keywords.json")
+    fake.register_view("per_account_distribution_sheet_master", "accounts", "names",
+                       lambda doc: [(doc["_id"], doc["Account Name"].strip())] if doc.get("Account Name") else [])
+    fake.register_view("user_aliases", "aliases", "by_canonical_key",
+                       lambda doc: [(doc["canonical_key"], doc.get("user_name"))] if doc.get("canonical_key") else [])
+
+    commit = _git_commit()
+    report = {"commit": commit, "started": datetime.now().isoformat(timespec="seconds"),
+              "latency_ms": args.latency, "python": sys.version.split()[0], "results": {}}
+    try:
+        for size_name in args.sizes:
+            for name, bench in BENCHMARKS.items():
+                if args.only and name not in args.only:
+                    continue
+                workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+                try:
+                    print(f"⏱️ {name} [{size_name}] ...", flush=True)
+                    result = bench(fake, SIZES[size_name], workdir)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                report["results"].setdefault(size_name, {})[name] = result
+                print(f"   {json.dumps(result)}")
+    finally:
+        fake.stop()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    previous = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), key=os.path.getmtime)
+    label = args.label or f"{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📁 Results saved to {path}")
+
+    baseline = args.baseline or (previous[-1] if previous else None)
+    if baseline and os.path.abspath(baseline) != os.path.abspath(path):
+        with open(baseline, encoding="utf-8") as f:
+            lines = compare(report, json.load(f), args.threshold)
+        print(f"📊 Compared with {os.path.basename(baseline)}:")
+        print("\n".join(lines) if lines else f"   no change beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Regression tests of the alias resolver against the fake CouchDB.
+
+    python -m pytest benchmarks/test_alias_resolver.py
+"""
+import os
+import sys
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_couchdb import FakeCouchDB
+from couchdb_client import get_session
+from doc_ids import alias_doc_id, canonical_alias_key
+from Fetching_Primary_account import AliasResolver
+
+
+@pytest.fixture
+def fake():
+    fake = FakeCouchDB().start()
+    fake.register_view("user_aliases", "aliases", "by_canonical_key",
+                       lambda doc: [(doc["canonical_key"], doc.get("user_name"))] if doc.get("canonical_key") else [])
+    get_session().put(f"{fake.url}/user_aliases").raise_for_status()
+    yield fake
+    fake.stop()
+
+
+def _put(fake, doc):
+    response = get_session().put(f"{fake.url}/user_aliases/{doc['_id']}", json=doc)
+    response.raise_for_status()
+    doc["_rev"] = response.json()["rev"]
+    return doc
+
+
+def test_renaming_a_legacy_duplicate_keeps_lookups_working(fake):
+    # Migration collisions leave two documents whose salesforce_names normalize alike
+    _put(fake, {"_id": "uuid1", "user_name": "Acme", "salesforce_name": "Acme"})
+    duplicate = _put(fake, {"_id": "uuid2", "user_name": "Acme", "salesforce_name": "ACME"})
+    resolver = AliasResolver(couchdb_url=fake.url)
+    assert resolver.lookup("Acme") == "Acme"
+
+    _put(fake, dict(duplicate, salesforce_name="Acme Renamed"))
+    resolver.refresh()
+    assert resolver.lookup("Acme Renamed") == "Acme"
+    assert resolver.lookup_many(["Acme", "acme renamed"]) == ({"acme renamed": "Acme"}, ["Acme"])
+
+
+def test_partial_cache_finds_documents_without_canonical_key(fake):
+    # Written before the canonical_key backfill ran, while the view already exists
+    for i in range(5):
+        _put(fake, {"_id": alias_doc_id(f"Name {i}"), "user_name": f"User {i}", "salesforce_name": f"Name {i}"})
+    resolver = AliasResolver(couchdb_url=fake.url, max_entries=2)
+    assert [resolver.lookup(f"Name {i}") for i in range(5)] == [f"User {i}" for i in range(5)]
+
+    resolver = AliasResolver(couchdb_url=fake.url, max_entries=2)
+    resolved, misses = resolver.lookup_many([f"Name {i}" for i in range(5)])
+    assert misses == [] and len(resolved) == 5
+
+
+def test_partial_cache_resolves_canonical_matches(fake):
+    _put(fake, {"_id": alias_doc_id("Acme Corporation"), "user_name": "Acme", "salesforce_name": "Acme Corporation",
+                "canonical_key": canonical_alias_key("Acme Corporation")})
+    for i in range(3):
+        _put(fake, {"_id": alias_doc_id(f"Other {i}"), "user_name": f"User {i}", "salesforce_name": f"Other {i}"})
+    resolver = AliasResolver(couchdb_url=fake.url, max_entries=2)
+    assert resolver.lookup("ACME Corp.") == "Acme"
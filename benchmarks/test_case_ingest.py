@@ -0,0 +1,132 @@
+"""Regression tests of the case ingest against the fake CouchDB.
+
+    python -m pytest benchmarks/test_case_ingest.py
+"""
+import os
+import sys
+import queue
+import threading
+import types
+
+import pytest
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_couchdb import FakeCouchDB
+from couchdb_client import get_session
+import case_queue
+from case_queue import CaseBatchWriter, CaseRow, ingest_case_file, iter_queued_chunks, parse_case_file
+from generators import make_case_workbook
+
+DB_NAME = "per_cases_to_triage_master"
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeCouchDB().start()
+    get_session().put(f"{fake.url}/{DB_NAME}").raise_for_status()
+    monkeypatch.setattr(case_queue, "fetch_primary_names", lambda names: ({name: "Acme" for name in names}, []))
+    yield fake
+    fake.stop()
+
+
+def _chunks(rows, size):
+    rows = [CaseRow(i + 3, f"SF {i}", "Subject", "2025-01-01 09:00", "Open", "Contact", str(100000 + i), "Sev 2", "Team A")
+            for i in range(rows)]
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+def _fail_second_write(monkeypatch):
+    write = CaseBatchWriter._write
+    calls = []
+
+    def flaky(self, docs):
+        calls.append(len(docs))
+        if len(calls) == 2:
+            raise requests.exceptions.ConnectionError("connection reset")
+        return write(self, docs)
+    monkeypatch.setattr(CaseBatchWriter, "_write", flaky)
+
+
+def _no_smtp(*args, **kwargs):
+    raise OSError("no mail relay in tests")
+
+
+def _stored_cases(fake):
+    return get_session().get(f"{fake.url}/{DB_NAME}/_all_docs").json()["total_rows"]
+
+
+def test_failed_chunk_write_queues_every_row_of_the_chunk(fake, monkeypatch):
+    _fail_second_write(monkeypatch)
+    retry_rows, seen_ids = [], set()
+    ok = ingest_case_file("SCBN New PER-a.xlsx", _chunks(30, 10), fake.url, DB_NAME, "admin", "admin",
+                          write_batch_size=10, seen_ids=seen_ids, retry_rows=retry_rows)
+    assert ok
+    assert _stored_cases(fake) == 20
+    assert sorted(entry["case_number"] for entry in retry_rows) == [str(100010 + i) for i in range(10)]
+    # The queued cases must not be synced away as missing from the export
+    assert len(seen_ids) == 30
+
+
+def test_failed_chunk_write_fails_the_file_without_a_retry_queue(fake, monkeypatch):
+    _fail_second_write(monkeypatch)
+    ok = ingest_case_file("SCBN New PER-a.xlsx", _chunks(30, 10), fake.url, DB_NAME, "admin", "admin",
+                          write_batch_size=10)
+    assert not ok
+
+
+def test_queued_rows_are_retried_without_a_new_export(fake, monkeypatch, tmp_path):
+    monkeypatch.setattr(case_queue, "log_dir", str(tmp_path / "logs"))
+    monkeypatch.setattr(case_queue, "smtplib", types.SimpleNamespace(SMTP=_no_smtp))
+    row = _chunks(1, 1)[0][0]
+    queue = {"rows": [dict(row._asdict(), file_name="SCBN New PER-a.xlsx", error="connection reset", attempts=1)]}
+    get_session().put(f"{fake.url}/{DB_NAME}/_local/ingest-retry-queue", json=queue).raise_for_status()
+
+    case_queue.process_files(str(tmp_path), fake.url, DB_NAME, "admin", "admin")
+    assert get_session().get(f"{fake.url}/{DB_NAME}/case:100000").status_code == 200
+    assert get_session().get(f"{fake.url}/{DB_NAME}/_local/ingest-retry-queue").json()["rows"] == []
+
+
+def test_fuzzy_fallback_without_an_account_master_still_ingests(fake, monkeypatch, tmp_path):
+    # The account master database does not exist on this server
+    monkeypatch.setattr(case_queue, "log_dir", str(tmp_path / "logs"))
+    monkeypatch.setattr(case_queue, "smtplib", types.SimpleNamespace(SMTP=_no_smtp))
+    row = _chunks(1, 1)[0][0]
+    queue = {"rows": [dict(row._asdict(), file_name="SCBN New PER-a.xlsx", error="connection reset", attempts=1)]}
+    get_session().put(f"{fake.url}/{DB_NAME}/_local/ingest-retry-queue", json=queue).raise_for_status()
+
+    case_queue.process_files(str(tmp_path), fake.url, DB_NAME, "admin", "admin", fuzzy_fallback=True)
+    assert get_session().get(f"{fake.url}/{DB_NAME}/case:100000").status_code == 200
+
+
+def test_sync_removes_random_id_documents_of_earlier_runs(fake):
+    db_url = f"{fake.url}/{DB_NAME}"
+    for doc_id in ("case:100000", "case:100001", "3f2c9e0d8a1b4c6e", "_design/cases"):
+        get_session().put(f"{db_url}/{doc_id}", json={"Case Number": doc_id}).raise_for_status()
+
+    affected = case_queue.sync_missing_cases(fake.url, DB_NAME, "admin", "admin", {"case:100000"})
+    assert sorted(affected) == ["3f2c9e0d8a1b4c6e", "case:100001"]
+    rows = get_session().get(f"{db_url}/_all_docs").json()["rows"]
+    assert [row["id"] for row in rows] == ["_design/cases", "case:100000"]
+
+
+def test_abandoned_file_does_not_block_its_parse_worker(fake, monkeypatch, tmp_path):
+    path = str(tmp_path / "SCBN New PER-a.xlsx")
+    make_case_workbook(path, 100, ["SF 1"], unknown_ratio=0)
+    _fail_second_write(monkeypatch)
+    chunk_queue = queue.Queue(2)
+    worker = threading.Thread(target=parse_case_file, args=(path, chunk_queue, 10))
+    worker.start()
+    ok = ingest_case_file("SCBN New PER-a.xlsx", iter_queued_chunks(chunk_queue), fake.url, DB_NAME, "admin", "admin",
+                          write_batch_size=10)
+    worker.join(timeout=10)
+    assert not ok and not worker.is_alive()
+
+
+def test_parse_error_in_the_worker_fails_the_file(fake):
+    chunk_queue = queue.Queue(2)
+    parse_case_file("missing.xlsx", chunk_queue, 10)
+    assert not ingest_case_file("missing.xlsx", iter_queued_chunks(chunk_queue), fake.url, DB_NAME, "admin", "admin")
@@ -1,116 +1,149 @@
 import os
 import re
+import json
+import time
 import pytz
 import glob
+import hashlib
 import shutil
 import logging
 import smtplib
-import requests
 import warnings
-import subprocess
-import pandas as pd
+import openpyxl
 from datetime import datetime
-from collections import Counter
+from collections import Counter, namedtuple
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from email.message import EmailMessage
 from requests.auth import HTTPBasicAuth
 # Import the Salesforce->Account alias lookup module
 
-from Fetching_Primary_account import fetch_primary_name
+from Fetching_Primary_account import fetch_primary_name, fetch_primary_names, get_alias_resolver
+from account_matcher import ACCOUNT_DB_NAME, AccountMatcher, iter_account_names, load_account_keywords
+from doc_ids import case_doc_id, doc_url
+from couchdb_schema import bootstrap_indexes
+from stage_runner import StageRunner
+from pipeline_metrics import METRICS, PROMETHEUS_FILE
+from ingest_journal import IngestJournal, load_retry_queue, merge_retry_rows, save_retry_queue
+from case_snapshot import SNAPSHOT_ENV, CaseSnapshot
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD, get_session, iter_view_rows
+
+session = get_session()
 
 # Setup logging
 log_dir = "/Users/Administrator/Desktop/RPA/smart_triage/RPA_Bot/logs"
-os.makedirs(log_dir, exist_ok=True)
 
-for old_log in glob.glob(os.path.join(log_dir, "smart_triage_log_*.txt")):
-    try:
-        os.remove(old_log)
-    except Exception as e:
-        print(f"Failed to delete old log file {old_log}: {e}")
+env = os.environ.copy()
 
-log_filename = f"smart_triage_log_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-log_filepath = os.path.join(log_dir, log_filename)
+def setup_run_logging():
+    """Starts a fresh run log file (removing the previous ones) and returns its path.
 
-env = os.environ.copy()
-env["SMART_TRIAGE_LOG_FILE"] = log_filepath
+    Kept out of module import so worker processes that import this module do not
+    delete or truncate the log of the run that spawned them.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+
+    old_files = (glob.glob(os.path.join(log_dir, "smart_triage_log_*.txt")) + glob.glob(os.path.join(log_dir, "smart_triage_metrics_*.json"))
+                 + glob.glob(os.path.join(log_dir, "smart_triage_cases_*")))
+    for old_log in old_files:
+        try:
+            os.remove(old_log)
+        except Exception as e:
+            print(f"Failed to delete old log file {old_log}: {e}")
 
-logging.basicConfig(
-    filename=log_filepath,
-    filemode='w',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+    log_filename = f"smart_triage_log_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
+    log_filepath = os.path.join(log_dir, log_filename)
+    env["SMART_TRIAGE_LOG_FILE"] = log_filepath
+
+    logging.basicConfig(
+        filename=log_filepath,
+        filemode='w',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        force=True
+    )
+    return log_filepath
 
 log = logging.getLogger()
 
-# Step 1: Read Excel by index
-def read_xlsx(file_path):
+def write_run_metrics(log_filepath):
+    """Writes the run's metrics next to its log file and logs the headline numbers."""
+    metrics_path = log_filepath.replace("smart_triage_log_", "smart_triage_metrics_").replace(".txt", ".json")
+    try:
+        METRICS.write(metrics_path, PROMETHEUS_FILE)
+    except OSError as e:
+        log.error(f"Failed to write run metrics to {metrics_path}: {e}")
+        return None
+    summary = METRICS.summary()
+    timings = {name: timer["total_seconds"] for name, timer in summary["timers"].items() if not name.startswith("http.")}
+    log.info(f"Run metrics: {summary['counters'].get('rows.read', 0)} rows at {summary['rows_per_second']} rows/s, "
+             f"{summary['http_calls']} CouchDB calls, time per step {timings} (details in {metrics_path})")
+    return metrics_path
+
+# Step 1: Stream the PER export by column index
+# Row 1 of the export is a title row and row 2 holds the headers; the fields
+# below are the 0-based positions of the columns the triage records use.
+CASE_COLUMNS = {
+    "alias_account_name": 1,
+    "subject": 2,
+    "date_opened": 3,
+    "status": 9,
+    "contact_name": 10,
+    "case_number": 11,
+    "severity": 12,
+    "mission_team": 13,
+}
+CASE_ROW_CHUNK_SIZE = 500
+
+CaseRow = namedtuple("CaseRow", ["row_number"] + list(CASE_COLUMNS))
+
+def _cell_text(value):
+    # Empty cells read as "nan", the text the pandas-based reader stored for them
+    return "nan" if value is None else str(value).strip()
+
+def iter_case_rows(file_path, chunk_size=CASE_ROW_CHUNK_SIZE):
+    """Yields lists of up to ``chunk_size`` CaseRow tuples from the first sheet of ``file_path``.
+
+    The workbook is opened read-only and walked with ``iter_rows(values_only=True)``,
+    so memory stays flat regardless of the size of the export.
+    """
     warnings.filterwarnings("ignore")
-    return pd.read_excel(file_path, engine="openpyxl", skiprows=1)
-
-# Step 2: Auto-detect ignore words
-def build_ignore_words(account_names):
-    word_counter = Counter()
-    suffix_counter = Counter()
-    for name in account_names:
-        words = re.split(r'\W+', name.lower())
-        word_counter.update(words)
-        for word in words[-3:]:
-            if word:
-                suffix_counter[word] += 1
-    total_names = len(account_names)
-    ignore_words = set()
-    for word, count in word_counter.items():
-        if not word:
-            continue
-        frequency = count / total_names
-        if len(word) <= 3 or frequency > 0.4:
-            ignore_words.add(word)
-    for word, count in suffix_counter.items():
-        if count > 2:
-            ignore_words.add(word)
-    return ignore_words
-
-# Step 3: Clean keywords
-def clean_keywords(text, ignore_words):
-    words = re.split(r'\W+', text.lower())
-    return [word for word in words if word and word not in ignore_words]
-
-# Step 4: Smart account matching (kept for reference but no longer used for final alias mapping)
-# The final Account Name will come from CouchDB alias lookup via alias_lookup.fetch_aliases_by_salesforce
-# This function can still be used for logging/debug if needed.
-def match_account_name_smart(excel_name, couchdb_names, ignore_words):
-    excel_keywords = clean_keywords(excel_name, ignore_words)
-    if not excel_keywords:
-        return [], [], "Skipped (No valid keywords)"
-    primary_keyword = excel_keywords[0]
-    matched_accounts, keywords_matched = [], []
-    match_status = "Skipped (No valid keywords)"
-    for couch_name in couchdb_names:
-        couch_keywords = clean_keywords(couch_name, ignore_words)
-        matched = set(excel_keywords).intersection(couch_keywords)
-        if not matched:
-            continue
-        matched_accounts.append(couch_name)
-        keywords_matched.append(list(matched))
-        match_status = "Closest Match" if primary_keyword in matched else "Tentative Match"
-    if not matched_accounts:
-        match_status = "Skipped (No familiar keywords)"
-    return matched_accounts, keywords_matched, match_status
+    width = max(CASE_COLUMNS.values()) + 1
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = wb.worksheets[0]
+        chunk = []
+        for row_number, values in enumerate(sheet.iter_rows(min_row=3, max_col=width, values_only=True), start=3):
+            if all(value is None for value in values):
+                continue
+            values = tuple(values) + (None,) * (width - len(values))
+            chunk.append(CaseRow(row_number, *(_cell_text(values[i]) for i in CASE_COLUMNS.values())))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        wb.close()
+
+# Steps 2-4 (ignore words, keyword cleaning, smart account matching) live in account_matcher.py.
+# The final Account Name comes from the CouchDB alias lookup (Fetching_Primary_account);
+# AccountMatcher is only used for the optional fuzzy fallback.
 
 # CouchDB utilities
 def recreate_db(couchdb_url, db_name, username, password):
     """Deletes and recreates a CouchDB database cleanly."""
     db_url = f"{couchdb_url}/{db_name}"
-    response = requests.get(db_url, auth=HTTPBasicAuth(username, password))
+    response = session.get(db_url, auth=HTTPBasicAuth(username, password))
     if response.status_code == 200:
         print(f"Database '{db_name}' already exists. Deleting for a clean start...")
-        delete_response = requests.delete(db_url, auth=HTTPBasicAuth(username, password))
+        delete_response = session.delete(db_url, auth=HTTPBasicAuth(username, password))
         if delete_response.status_code in (200, 202):
             print(f"Database '{db_name}' deleted successfully.")
         else:
             raise Exception(f"Failed to delete database '{db_name}': {delete_response.status_code}, {delete_response.text}")
     
-    create_response = requests.put(db_url, auth=HTTPBasicAuth(username, password))
+    create_response = session.put(db_url, auth=HTTPBasicAuth(username, password))
     if create_response.status_code in (200, 201):
         print(f"Database '{db_name}' recreated successfully.")
     else:
@@ -118,150 +151,616 @@ def recreate_db(couchdb_url, db_name, username, password):
 
 def create_db_if_not_exists(couchdb_url, db_name, username, password):
     url = f"{couchdb_url}/{db_name}"
-    response = requests.get(url, auth=HTTPBasicAuth(username, password))
+    response = session.get(url, auth=HTTPBasicAuth(username, password))
     if response.status_code == 404:
-        requests.put(url, auth=HTTPBasicAuth(username, password))
+        session.put(url, auth=HTTPBasicAuth(username, password))
     elif response.status_code != 200:
         log.error(f"Error accessing DB: {response.text}")
 
 def fetch_all_account_names(couchdb_url, username, password):
-    url = f"{couchdb_url}/per_account_distribution_sheet_master/_all_docs?include_docs=true"
-    response = requests.get(url, auth=HTTPBasicAuth(username, password))
-    account_names = []
-    if response.status_code == 200:
-        for row in response.json()['rows']:
-            doc = row.get('doc', {})
-            name = doc.get('Account Name', '').strip()
-            if name:
-                account_names.append(name)
-    return account_names
+    """Lazily yields every account name, paging through the name-only accounts view."""
+    yield from iter_account_names(couchdb_url, username, password)
 
 def check_case_exists(couchdb_url, db_name, username, password, case_number):
-    url = f"{couchdb_url}/{db_name}/_find"
-    query = {"selector": {"Case Number": case_number}}
-    response = requests.post(url, json=query, auth=HTTPBasicAuth(username, password))
-    if response.status_code == 200 and response.json()['docs']:
-        return response.json()['docs'][0]
+    url = doc_url(f"{couchdb_url}/{db_name}", case_doc_id(case_number))
+    response = session.get(url, auth=HTTPBasicAuth(username, password))
+    if response.status_code == 200:
+        return response.json()
     return None
 
+# Number of case documents resolved and written per _bulk_docs request
+CASE_WRITE_BATCH_SIZE = 500
+
+# Flag set on cases that disappeared from the PER export when syncing with missing_cases="mark"
+MISSING_FLAG = "Missing From Source"
+
+def case_content_hash(record):
+    """Stable hash of a cleaned case record (ignores CouchDB and sync bookkeeping fields)."""
+    content = {k: v for k, v in record.items() if k not in ("_id", "_rev", "Content Hash", MISSING_FLAG)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class CaseBatchWriter:
+    """Collects cleaned case records and upserts the changed ones in chunks.
+
+    Documents are keyed ``case:<Case Number>`` and carry a ``Content Hash`` of
+    the record, so each chunk costs one keyed ``_all_docs`` read and at most one
+    ``_bulk_docs`` write containing only new or changed cases. Per-document
+    outcomes (inserted, updated, unchanged, or the error including conflicts)
+    are kept in ``results``; the IDs of every case seen go into ``seen_ids``.
+    """
+
+    def __init__(self, couchdb_url, db_name, username, password, batch_size=CASE_WRITE_BATCH_SIZE, seen_ids=None):
+        self.db_url = f"{couchdb_url}/{db_name}"
+        self.auth = HTTPBasicAuth(username, password)
+        self.batch_size = batch_size
+        self.seen_ids = seen_ids if seen_ids is not None else set()
+        self.results = []
+        self._pending = []
+
+    def add(self, record, flush=True):
+        """Queues ``record``; with ``flush`` a full batch is written right away.
+
+        Callers that write their own chunks pass ``flush=False`` and call ``flush``
+        once, so a failed write is charged to the whole chunk, not to its last row.
+        """
+        self._pending.append(record)
+        if flush and len(self._pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def _fetch_current(self, doc_ids):
+        response = session.post(f"{self.db_url}/_all_docs", json={"keys": doc_ids, "include_docs": True}, auth=self.auth)
+        response.raise_for_status()
+        current = {}
+        for row in response.json().get("rows", []):
+            doc = row.get("doc")
+            if doc:
+                current[row["id"]] = doc
+        return current
+
+    def _write(self, docs):
+        response = session.post(f"{self.db_url}/_bulk_docs", json={"docs": docs}, auth=self.auth)
+        response.raise_for_status()
+        return response.json()
+
+    def flush(self):
+        if not self._pending:
+            return []
+        with METRICS.timer("couchdb_write"):
+            return self._flush()
+
+    def _flush(self):
+        # A case repeated within the chunk keeps its last row, as sequential upserts did
+        chunk = list({case_doc_id(record.get("Case Number")): record for record in self._pending}.values())
+        self._pending = []
+
+        for record in chunk:
+            record["_id"] = case_doc_id(record.get("Case Number"))
+            record["Content Hash"] = case_content_hash(record)
+            self.seen_ids.add(record["_id"])
+        current = self._fetch_current([record["_id"] for record in chunk])
+
+        chunk_results = []
+        writes, actions = [], []
+        for record in chunk:
+            doc = current.get(record["_id"])
+            if doc and doc.get("Content Hash") == record["Content Hash"] and not doc.get(MISSING_FLAG):
+                chunk_results.append({"Case Number": record.get("Case Number"), "action": "unchanged", "id": record["_id"], "ok": True})
+                continue
+            if doc:
+                record["_rev"] = doc["_rev"]
+            writes.append(record)
+            actions.append("updated" if doc else "inserted")
+
+        outcomes = self._write(writes) if writes else []
+
+        # Another writer got in between the key lookup and the write: re-read those revisions once
+        conflicted = [i for i, outcome in enumerate(outcomes) if outcome.get("error") == "conflict"]
+        if conflicted:
+            current = self._fetch_current([writes[i]["_id"] for i in conflicted])
+            retry = []
+            for i in conflicted:
+                writes[i].pop("_rev", None)
+                if writes[i]["_id"] in current:
+                    writes[i]["_rev"] = current[writes[i]["_id"]]["_rev"]
+                    actions[i] = "updated"
+                retry.append(writes[i])
+            for i, outcome in zip(conflicted, self._write(retry)):
+                outcomes[i] = outcome
+
+        for record, action, outcome in zip(writes, actions, outcomes):
+            result = {"Case Number": record.get("Case Number"), "action": action, "id": outcome.get("id")}
+            if "error" in outcome:
+                result.update({"ok": False, "error": outcome["error"], "reason": outcome.get("reason")})
+                log.error(f"Failed to write {record.get('Case Number')}: {outcome['error']} ({outcome.get('reason')})")
+            else:
+                result["ok"] = True
+                log.debug(f"{action.capitalize()}: {record.get('Case Number')}")
+            chunk_results.append(result)
+        self.results.extend(chunk_results)
+
+        actions = Counter(result["action"] if result["ok"] else "failed" for result in chunk_results)
+        for action, count in actions.items():
+            METRICS.incr(f"cases.{action}", count)
+        log.info(f"Wrote batch of {len(chunk_results)} cases: {dict(actions)}")
+        return chunk_results
+
+    def failures(self):
+        return [result for result in self.results if not result["ok"]]
+
+def sync_missing_cases(couchdb_url, db_name, username, password, seen_ids, policy="delete", batch_size=CASE_WRITE_BATCH_SIZE):
+    """Handles stored cases that were not in this run's PER exports.
+
+    ``policy`` is "delete" (drop them, matching the old recreate-per-run result),
+    "mark" (set the "Missing From Source" flag) or "keep". Returns the affected IDs.
+    Documents outside the ``case:`` range, left by runs from before the
+    deterministic IDs, are never seen and so go the same way.
+    """
+    if policy == "keep":
+        return []
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+
+    # Key-only scan of the whole database (the database is no longer recreated, so nothing else
+    # removes the random-ID documents); document bodies are fetched only for "mark"
+    rows = iter_view_rows(f"{db_url}/_all_docs", auth=auth)
+    missing = [(row["id"], row["value"]["rev"]) for row in rows
+               if row["id"] not in seen_ids and not row["id"].startswith("_design/")]
+
+    affected = []
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        if policy == "delete":
+            docs = [{"_id": doc_id, "_rev": rev, "_deleted": True} for doc_id, rev in chunk]
+        else:
+            response = session.post(f"{db_url}/_all_docs", json={"keys": [doc_id for doc_id, _ in chunk], "include_docs": True}, auth=auth)
+            response.raise_for_status()
+            docs = [row["doc"] for row in response.json().get("rows", []) if row.get("doc") and not row["doc"].get(MISSING_FLAG)]
+            for doc in docs:
+                doc[MISSING_FLAG] = True
+        if not docs:
+            continue
+        response = session.post(f"{db_url}/_bulk_docs", json={"docs": docs}, auth=auth)
+        response.raise_for_status()
+        for outcome in response.json():
+            if "error" in outcome:
+                log.error(f"Failed to {policy} missing case {outcome.get('id')}: {outcome['error']}")
+            else:
+                affected.append(outcome["id"])
+    log.info(f"Missing cases ({policy}): {len(affected)}")
+    return affected
+
 def insert_or_update_record(couchdb_url, db_name, username, password, record):
-    case_number = record.get('Case Number')
-    existing = check_case_exists(couchdb_url, db_name, username, password, case_number)
-    if existing:
-        record.update({"_rev": existing["_rev"], "_id": existing["_id"]})
-        url = f"{couchdb_url}/{db_name}/{existing['_id']}"
-        requests.put(url, json=record, auth=HTTPBasicAuth(username, password))
-        log.info(f"Updated: {case_number}")
-    else:
-        url = f"{couchdb_url}/{db_name}"
-        requests.post(url, json=record, auth=HTTPBasicAuth(username, password))
-        log.info(f"Inserted: {case_number}")
+    writer = CaseBatchWriter(couchdb_url, db_name, username, password, batch_size=1)
+    return writer.add(record)
 
 def insert_record(couchdb_url, db_name, username, password, record):
     """Inserts a new record (no updates)."""
     url = f"{couchdb_url}/{db_name}"
-    response = requests.post(url, json=record, auth=HTTPBasicAuth(username, password))
+    record = {**record, "_id": case_doc_id(record.get("Case Number"))}
+    response = session.post(url, json=record, auth=HTTPBasicAuth(username, password))
     if response.status_code in (200, 201):
         print(f"Inserted: {record.get('Case Number')}")
     else:
         print(f"Failed to insert {record.get('Case Number')}: {response.status_code} {response.text}")
 
-def process_files(folder_path, couchdb_url, db_name, username, password):
-    #create_db_if_not_exists(couchdb_url, db_name, username, password)
-    recreate_db(couchdb_url, db_name, username, password)
-    couch_account_names = fetch_all_account_names(couchdb_url, username, password)
-    ignore_words = build_ignore_words(couch_account_names)
-    #print(f"Auto-detected ignore words: {sorted(ignore_words)}")
+# Parsed chunks a parse worker may run ahead of the writes of its file
+PARSE_QUEUE_CHUNKS = 2
+
+def parse_case_file(file_path, chunk_queue, chunk_size=CASE_ROW_CHUNK_SIZE):
+    """Streams a PER export into ``chunk_queue``; runs in a worker process when ingesting in parallel.
+
+    The queue is bounded, so a file is never held in memory whole. The stream
+    ends with None, or with the exception that stopped the parse.
+    """
+    try:
+        for chunk in iter_case_rows(file_path, chunk_size):
+            chunk_queue.put(chunk)
+    except Exception as e:
+        chunk_queue.put(e)
+        return
+    chunk_queue.put(None)
+
+def iter_queued_chunks(chunk_queue):
+    """Yields the chunks ``parse_case_file`` puts on ``chunk_queue``."""
+    item = chunk_queue.get()
+    try:
+        while item is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            item = chunk_queue.get()
+    finally:
+        # A file abandoned halfway must not leave its parse worker blocked on the full queue
+        while item is not None and not isinstance(item, Exception):
+            item = chunk_queue.get()
+
+def build_case_record(row, matcher=None, unresolved=None, fuzzy_matched=None, resolved=None):
+    """Resolves the primary account of one CaseRow; returns the triage record, or None to skip the row.
+
+    Unresolved aliases and fuzzy matches are tallied in the given Counters so the
+    caller can log them once per file. ``resolved`` is the mapping returned by
+    ``fetch_primary_names`` for the row's chunk; without it the alias is looked up
+    on its own.
+    """
+    case_number = row.case_number
+    alias_account_name = row.alias_account_name
+    contact_name = row.contact_name
+    subject = row.subject
+    status = row.status
+    date_opened = row.date_opened
+    mission_team = row.mission_team
+    severity = row.severity
+
+    log.debug(f"Looking up primary name for Salesforce Account Name: '{alias_account_name}'")
+
+    # Use the Fetching_Primary_account.fetch_primary_name with the alias_account_name from Excel
+    try:
+        if resolved is not None:
+            primary_account_name = resolved.get(alias_account_name)
+        else:
+            with METRICS.timer("alias_lookup"):
+                primary_account_name = fetch_primary_name(alias_account_name)  # expected to return/print the primary name
+    except Exception as err:
+        log.error(f"Primary name fetch error for '{alias_account_name}': {err}")
+        primary_account_name = None
+
+    match_info = {"Matched Accounts": primary_account_name, "Match Type": "Exact Match"}
+    if (not primary_account_name or not str(primary_account_name).strip()) and matcher is not None:
+        fuzzy = matcher.best_match(alias_account_name)
+        if fuzzy and fuzzy[3] == "Closest Match":
+            primary_account_name, score, keywords, match_type = fuzzy
+            match_info = {"Matched Accounts": primary_account_name, "Match Type": match_type,
+                          "Match Score": score, "Matched Keywords": keywords}
+            if fuzzy_matched is not None:
+                fuzzy_matched[(alias_account_name, primary_account_name)] += 1
+            METRICS.incr("rows.fuzzy_matched")
+
+    if not primary_account_name or not str(primary_account_name).strip():
+        log.debug(f"No primary name found for Salesforce Account Name: '{alias_account_name}'. Skipping row.")
+        if unresolved is not None:
+            unresolved[alias_account_name] += 1
+        METRICS.incr("rows.skipped_no_alias")
+        return None
+
+    log.debug(f"Primary name resolved. Using Account Name: '{primary_account_name}' from Salesforce '{alias_account_name}'")
+
+    if primary_account_name == "Sterling Commerce, Inc. - Single Sign On - EMEA":
+        return None
+    return {
+        "Case Number": case_number,
+        "Account Name": primary_account_name,
+        "Subject": subject,
+        "Severity": severity,
+        "Contact Name": contact_name,
+        "Date/Time Opened": date_opened,
+        "Mission Team": mission_team,
+        "Status": status,
+        "Match Info": match_info
+    }
+
+def _retry_entry(row, file_name, error, attempts=0):
+    return dict(row._asdict(), file_name=file_name, error=str(error), attempts=attempts)
+
+def ingest_case_file(file_name, chunks, couchdb_url, db_name, username, password, write_batch_size=CASE_WRITE_BATCH_SIZE,
+                     seen_ids=None, matcher=None, journal=None, retry_rows=None, snapshot=None):
+    """Resolves and writes the rows of one case file; returns True when the file went through.
+
+    ``chunks`` is any iterable of CaseRow chunks (the streaming reader, or
+    ``iter_queued_chunks`` fed by a parse worker). The IDs of the
+    cases written or found unchanged are added to ``seen_ids``. With an
+    AccountMatcher, rows whose alias is not mapped fall back to its best
+    "Closest Match" instead of being skipped.
+
+    With an IngestJournal, every committed chunk is checkpointed and the chunks
+    (or the whole file) committed by an earlier run are skipped. Rows that fail
+    are appended to ``retry_rows`` for the next run instead of failing the file;
+    without a retry list they fail the file as before.
+
+    Every cleaned record is also added to ``snapshot`` (a CaseSnapshot).
+    """
+    log.info(f"Processing case file: {file_name}")
+    file_processed_successfully = True
+    seen_ids = seen_ids if seen_ids is not None else set()
+
+    writer = CaseBatchWriter(couchdb_url, db_name, username, password, batch_size=write_batch_size, seen_ids=seen_ids)
+    # Per-row outcomes are aggregated into one log line per file instead of three lines per row
+    row_count = 0
+    unresolved = Counter()
+    fuzzy_matched = Counter()
+    skip_chunks = journal.chunks_done if journal else 0
+    if journal and journal.complete:
+        log.info(f"'{file_name}' was fully ingested by an earlier run; skipping its rows")
+        skip_chunks = float("inf")
+
+    chunks = iter(chunks)
+    try:
+        chunk_index = 0
+        while True:
+            # Pulling the next chunk is where the streaming reader parses the workbook
+            with METRICS.timer("excel_parse"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            chunk_index += 1
+            if chunk_index <= skip_chunks:
+                # Committed by an earlier run: these cases still belong to this export
+                seen_ids.update(case_doc_id(row.case_number) for row in chunk)
+                METRICS.incr("rows.resumed", len(chunk))
+                if snapshot is not None:
+                    snapshot.complete = False
+                continue
+
+            row_count += len(chunk)
+            METRICS.incr("rows.read", len(chunk))
+            rows_by_case = {}
+            chunk_retry_rows = []
+            written_before = len(writer.results)
+            # Resolve the chunk's distinct aliases together instead of once per row
+            try:
+                with METRICS.timer("alias_lookup"):
+                    resolved, _ = fetch_primary_names(row.alias_account_name for row in chunk)
+            except Exception as err:
+                log.error(f"Bulk primary name fetch failed; looking up aliases one by one: {err}")
+                resolved = None
+            for row in chunk:
+                try:
+                    cleaned_record = build_case_record(row, matcher, unresolved, fuzzy_matched, resolved)
+                    if cleaned_record is not None:
+                        rows_by_case[cleaned_record["Case Number"]] = row
+                        if snapshot is not None:
+                            snapshot.add(cleaned_record)
+                        writer.add(cleaned_record, flush=False)
+                except Exception as e:
+                    log.exception(f"Error processing row {row.row_number}: {e}")
+                    METRICS.incr("rows.failed")
+                    if retry_rows is None:
+                        file_processed_successfully = False
+                    else:
+                        chunk_retry_rows.append(_retry_entry(row, file_name, e))
+            # Each streamed chunk is written as one batch
+            try:
+                writer.flush()
+            except Exception as e:
+                # Nothing of the chunk is known to be written: queue all of it, or fail the file before its checkpoint
+                if retry_rows is None:
+                    raise
+                log.error(f"Failed to write chunk {chunk_index} of '{file_name}', queueing its {len(rows_by_case)} rows: {e}")
+                METRICS.incr("rows.failed", len(rows_by_case))
+                chunk_retry_rows.extend(_retry_entry(row, file_name, e) for row in rows_by_case.values())
+
+            failed = [result for result in writer.results[written_before:] if not result["ok"]]
+            if failed and retry_rows is None:
+                file_processed_successfully = False
+            elif failed:
+                for result in failed:
+                    # A failed update must not look like a case that left the export
+                    seen_ids.add(case_doc_id(result["Case Number"]))
+                    chunk_retry_rows.append(_retry_entry(rows_by_case[result["Case Number"]], file_name, result.get("error")))
+            if retry_rows is not None:
+                retry_rows.extend(chunk_retry_rows)
+            if journal:
+                # The failed rows are persisted with the checkpoint that skips their chunk on a resume
+                journal.checkpoint(chunk_index, chunk_retry_rows)
+
+        if journal and not journal.complete:
+            journal.mark_complete()
+        log.info(f"'{file_name}': {row_count} rows, {sum(unresolved.values())} skipped without a primary name, "
+                 f"{sum(fuzzy_matched.values())} fuzzy matched")
+        for alias_account_name, count in unresolved.most_common():
+            log.warning(f"No primary name found for Salesforce Account Name: '{alias_account_name}' ({count} rows skipped)")
+        for (alias_account_name, primary_account_name), count in fuzzy_matched.most_common():
+            log.info(f"Alias '{alias_account_name}' not mapped; used closest account '{primary_account_name}' ({count} rows)")
+        if writer.failures():
+            log.error(f"{len(writer.failures())} case documents failed to write for '{file_name}'")
+    except Exception as file_err:
+        log.exception(f"Error processing file '{file_name}': {file_err}")
+        file_processed_successfully = False
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+    return file_processed_successfully
+
+def retry_failed_rows(entries, couchdb_url, db_name, username, password, seen_ids=None, matcher=None, snapshot=None):
+    """Runs the queued rows of earlier runs through the ingest again; returns the ones still failing."""
+    if not entries:
+        return []
+    log.info(f"Retrying {len(entries)} queued case rows")
+    writer = CaseBatchWriter(couchdb_url, db_name, username, password, batch_size=len(entries), seen_ids=seen_ids)
+    remaining, queued = [], {}
+    rows = [CaseRow(**{field: entry.get(field) for field in CaseRow._fields}) for entry in entries]
+    try:
+        resolved, _ = fetch_primary_names(row.alias_account_name for row in rows)
+    except Exception as err:
+        log.error(f"Bulk primary name fetch failed; looking up aliases one by one: {err}")
+        resolved = None
+    for entry, row in zip(entries, rows):
+        try:
+            cleaned_record = build_case_record(row, matcher, resolved=resolved)
+            if cleaned_record is not None:
+                queued[cleaned_record["Case Number"]] = entry
+                if snapshot is not None:
+                    snapshot.add(cleaned_record)
+                writer.add(cleaned_record, flush=False)
+        except Exception as e:
+            remaining.append(dict(entry, error=str(e), attempts=entry.get("attempts", 0) + 1))
+    try:
+        writer.flush()
+    except Exception as e:
+        log.error(f"Retry of queued rows failed: {e}")
+        return [dict(entry, error=str(e), attempts=entry.get("attempts", 0) + 1) for entry in entries]
+    for result in writer.failures():
+        entry = queued[result["Case Number"]]
+        remaining.append(dict(entry, error=result.get("error"), attempts=entry.get("attempts", 0) + 1))
+    log.info(f"Retried queued rows: {len(entries) - len(remaining)} done, {len(remaining)} still failing")
+    return remaining
+
+# Warm state reused by later runs of a long-lived process (see case_watcher.py)
+_bootstrapped = set()
+_warm_matcher = None  # (keyword statistics sequence, AccountMatcher)
+
+def is_case_file(file_name):
+    return re.match(r"SCBN New PER-[\w\- ]+\.xlsx$", file_name, re.IGNORECASE) is not None
+
+def get_account_matcher(couchdb_url, username, password):
+    """AccountMatcher over the current account master, rebuilt only when the accounts changed."""
+    global _warm_matcher
+    # Ignore words come from the stored keyword statistics, brought up to date from _changes
+    account_keywords = load_account_keywords(couchdb_url, username, password)
+    if _warm_matcher is None or _warm_matcher[0] != account_keywords.since:
+        _warm_matcher = (account_keywords.since, AccountMatcher(account_keywords.account_names(), account_keywords.ignore_words()))
+    return _warm_matcher[1]
+
+def process_files(folder_path, couchdb_url, db_name, username, password, write_batch_size=CASE_WRITE_BATCH_SIZE,
+                  workers=1, io_workers=None, full_reload=False, missing_cases="delete", fuzzy_fallback=False,
+                  file_names=None):
+    """Ingests every matching PER export in ``folder_path`` and runs the downstream stages on them.
+
+    Only new or changed cases are written; ``missing_cases`` ("delete", "mark"
+    or "keep") decides what happens to stored cases absent from a clean run, and
+    ``full_reload`` drops and recreates the database instead. ``workers`` parse
+    several files in a process pool while ``io_workers`` threads (default
+    ``workers``) do their CouchDB reads and writes. ``fuzzy_fallback`` maps
+    unknown aliases to the closest account of the account master, and
+    ``file_names`` limits the run to those exports.
+    """
+    log_filepath = setup_run_logging()
+    METRICS.reset()
+    METRICS.install_http_hook(session)
+    if full_reload:
+        recreate_db(couchdb_url, db_name, username, password)
+    else:
+        create_db_if_not_exists(couchdb_url, db_name, username, password)
+    if full_reload or (couchdb_url, db_name) not in _bootstrapped:
+        try:
+            bootstrap_indexes(couchdb_url, username, password, [db_name, ACCOUNT_DB_NAME])
+            _bootstrapped.add((couchdb_url, db_name))
+        except Exception as e:
+            log.warning(f"Could not provision indexes and views for '{db_name}' and '{ACCOUNT_DB_NAME}': {e}")
+    # The account master is only read for the fuzzy fallback; without it rows are matched by alias alone
+    matcher = None
+    if fuzzy_fallback:
+        try:
+            with METRICS.timer("account_keywords"):
+                matcher = get_account_matcher(couchdb_url, username, password)
+        except Exception as e:
+            log.warning(f"Could not load the account master '{ACCOUNT_DB_NAME}'; continuing without the fuzzy fallback: {e}")
     archive_dir = os.path.join(folder_path, "Processed RPA case files")
     os.makedirs(archive_dir, exist_ok=True)
 
     found_files = [f for f in os.listdir(folder_path) if f.endswith(".xlsx") and not f.startswith("~$")]
-    if not found_files:
+    case_files = [f for f in found_files if is_case_file(f) and (file_names is None or f in file_names)]
+    seen_ids = set()
+    snapshot = CaseSnapshot()
+    ingest_args = (couchdb_url, db_name, username, password, write_batch_size, seen_ids, matcher)
+
+    journals = {}
+    for file_name in case_files:
+        try:
+            journals[file_name] = IngestJournal.for_file(couchdb_url, db_name, username, password,
+                                                         os.path.join(folder_path, file_name), file_name, write_batch_size)
+        except Exception as e:
+            log.warning(f"No progress journal for '{file_name}', ingesting it from the first row: {e}")
+            journals[file_name] = None
+
+    # Rows that failed in earlier runs go first; new failures join the queue instead of failing their file.
+    # Failed rows still held by a journal belong to a run that ended before saving the queue.
+    retry_rows, queued = [], []
+    try:
+        retry_queue = load_retry_queue(couchdb_url, db_name, username, password)
+        queued = merge_retry_rows(retry_queue["rows"], [entry for journal in journals.values() if journal
+                                                        for entry in journal.failed_rows])
+        retry_rows.extend(retry_failed_rows(queued, *ingest_args[:4], seen_ids=seen_ids, matcher=ingest_args[-1],
+                                            snapshot=snapshot))
+    except Exception as e:
+        log.error(f"Could not load the retry queue: {e}")
+        retry_queue = None
+    # The queue is drained even when no export is waiting; an empty run ends here
+    if not case_files and not queued:
         print("No RPA extracted files in the target folder to process.")
         return
 
-    for file_name in found_files:
-        if not re.match(r"SCBN New PER-[\w\- ]+\.xlsx$", file_name, re.IGNORECASE):
-            #log.warning(f"Skipping unmatched pattern file: {file_name}")
-            continue
-
-        log.info(f"Processing case file: {file_name}")
-        file_path = os.path.join(folder_path, file_name)
-        file_processed_successfully = True
+    results = {}
+    ingest_start = time.perf_counter()
+    if workers > 1 and len(case_files) > 1:
+        # Workers hand their chunks over through bounded queues, so memory stays flat as with one worker
+        with Manager() as manager, ProcessPoolExecutor(max_workers=workers) as parse_pool, \
+                ThreadPoolExecutor(max_workers=io_workers or workers) as io_pool:
+            futures = {}
+            for file_name in case_files:
+                chunk_queue = manager.Queue(PARSE_QUEUE_CHUNKS)
+                parse_pool.submit(parse_case_file, os.path.join(folder_path, file_name), chunk_queue, write_batch_size)
+                futures[file_name] = io_pool.submit(ingest_case_file, file_name, iter_queued_chunks(chunk_queue), *ingest_args,
+                                                    journal=journals[file_name], retry_rows=retry_rows, snapshot=snapshot)
+            for file_name, future in futures.items():
+                results[file_name] = future.result()
+    else:
+        for file_name in case_files:
+            chunks = iter_case_rows(os.path.join(folder_path, file_name), chunk_size=write_batch_size)
+            results[file_name] = ingest_case_file(file_name, chunks, *ingest_args,
+                                                  journal=journals[file_name], retry_rows=retry_rows, snapshot=snapshot)
+    METRICS.observe("ingest", time.perf_counter() - ingest_start)
+
+    if retry_queue is not None:
+        METRICS.set_gauge("retry_queue.size", len(retry_rows))
+        try:
+            save_retry_queue(couchdb_url, db_name, username, password, retry_queue, retry_rows)
+            for journal in journals.values():
+                if journal:
+                    journal.clear_failed_rows()
+        except Exception as e:
+            log.error(f"Could not save the retry queue ({len(retry_rows)} rows): {e}")
 
+    # Only a run in which every file went through completely describes the full set of open cases
+    if case_files and all(results.values()):
         try:
-            df = read_xlsx(file_path)
-            for index, row in df.iterrows():
-                try:
-                    case_number = str(row.iloc[11]).strip()
-                    alias_account_name = str(row.iloc[1]).strip()
-                    contact_name = str(row.iloc[10]).strip()
-                    subject = str(row.iloc[2]).strip()
-                    status = str(row.iloc[9]).strip()
-                    date_opened = str(row.iloc[3]).strip()
-                    mission_team = str(row.iloc[13]).strip()
-                    severity = str(row.iloc[12]).strip()
-
-                    log.info(f"Looking up primary name for Salesforce Account Name: '{alias_account_name}'")
-
-                    # Use the Fetching_Primary_account.fetch_primary_name with the alias_account_name from Excel
-                    try:
-                        primary_account_name = fetch_primary_name(alias_account_name)  # expected to return/print the primary name
-                    except Exception as err:
-                        log.error(f"Primary name fetch error for '{alias_account_name}': {err}")
-                        primary_account_name = None
-
-                    if not primary_account_name or not str(primary_account_name).strip():
-                        log.warning(f"No primary name found for Salesforce Account Name: '{alias_account_name}'. Skipping row.")
-                        continue
-
-                    log.info(f"Primary name resolved. Using Account Name: '{primary_account_name}' from Salesforce '{alias_account_name}'")
-
-                    cleaned_record = {
-                        "Case Number": case_number,
-                        "Account Name": primary_account_name,
-                        "Subject": subject,
-                        "Severity": severity,
-                        "Contact Name": contact_name,
-                        "Date/Time Opened": date_opened,
-                        "Mission Team": mission_team,
-                        "Status": status,
-                        "Match Info": {
-                            "Matched Accounts": primary_account_name,
-                            "Match Type": "Exact Match"
-                        }
-                    }
-                    
-
-
-                    if primary_account_name != "Sterling Commerce, Inc. - Single Sign On - EMEA":
-                        insert_or_update_record(couchdb_url, db_name, username, password, cleaned_record)
-                except Exception as e:
-                    log.exception(f"Error processing row {index + 2}: {e}")
-                    file_processed_successfully = False
-        except Exception as file_err:
-            log.exception(f"Error processing file '{file_name}': {file_err}")
-            file_processed_successfully = False
+            with METRICS.timer("sync_missing_cases"):
+                sync_missing_cases(couchdb_url, db_name, username, password, seen_ids, policy=missing_cases)
+        except Exception as e:
+            log.error(f"Failed to sync cases missing from the source files: {e}")
 
+    # The stages read the snapshot instead of the database only when it holds every case of the exports
+    env.pop(SNAPSHOT_ENV, None)
+    if case_files and all(results.values()) and snapshot.complete:
         try:
-            subprocess.run(["python3", "per_leave_update.py"], check=True) ####
-            log.info("Called per_leave_update.py successfully.")
-            subprocess.run(["python3", "per_account_sme.py"], check=True)
-            log.info("Called per_account_sme.py successfully.")
-            subprocess.run(["python3", "per_time_spent.py"], check=True)
-            log.info("Called per_time_spent.py successfully.")
-
-            if file_processed_successfully:
-                subprocess.run(["python3", "model.py"], check=True, env=env)
-                log.info("Called model.py successfully.")
+            with METRICS.timer("case_snapshot"):
+                stem = log_filepath.replace("smart_triage_log_", "smart_triage_cases_").replace(".txt", "")
+                env[SNAPSHOT_ENV] = snapshot.write(stem)
+        except Exception as e:
+            log.error(f"Could not write the case snapshot; stages will read CouchDB: {e}")
+
+    # Downstream stages run once for the whole batch; the model runs after every file is in
+    if case_files:
+        runner = StageRunner(env=env)
+        for file_name in case_files:
+            runner.trigger("per_leave_update", "per_account_sme", "per_time_spent")
+            if results[file_name]:
+                runner.trigger("model")
+        stage_results = runner.run()
+        for result in stage_results.values():
+            METRICS.observe(f"stage.{result.name}", result.seconds)
+
+        if stage_results.get("model") and stage_results["model"].ok:
+            for file_name in case_files:
+                if not results[file_name]:
+                    continue
                 archive_path = os.path.join(archive_dir, file_name)
-                shutil.move(file_path, archive_path)
+                shutil.move(os.path.join(folder_path, file_name), archive_path)
                 log.info(f"Successfully processed and moved to archive: {file_name}")
-        except subprocess.CalledProcessError as e:
-            log.error(f"Script failed: {e}")
+                if journals.get(file_name):
+                    journals[file_name].discard()
     else:
         log.info(f"No RPA extracted files in the target folder to process")
 
+    alias_stats = get_alias_resolver().stats()
+    log.info(f"Alias cache stats: {alias_stats}")
+    lookups = alias_stats["hits"] + alias_stats["misses"]
+    METRICS.set_gauge("alias_cache.size", alias_stats["size"])
+    METRICS.set_gauge("alias_cache.hit_rate", round(alias_stats["hits"] / lookups, 4) if lookups else 0.0)
+    METRICS.set_gauge("alias_cache.canonical_hits", alias_stats["canonical_hits"])
+    write_run_metrics(log_filepath)
+
     # Close log handlers
     for handler in log.handlers:
         handler.close()
@@ -303,10 +802,11 @@ def process_files(folder_path, couchdb_url, db_name, username, password):
         print("No log files found to send.")
 
 if __name__ == "__main__":
-    couchdb_url = "http://9.20.195.22:5984"
+    couchdb_url = COUCHDB_URL
     db_name = "per_cases_to_triage_master"
-    username = "admin"
-    password = "admin123"
+    username = COUCHDB_USER
+    password = COUCHDB_PASSWORD
     folder_path = "/Users/Administrator/Downloads/"
+    workers = min(4, os.cpu_count() or 1)  # parallel parse/ingest when a backlog of files is waiting
 
-    process_files(folder_path, couchdb_url, db_name, username, password) ####
\ No newline at end of file
+    process_files(folder_path, couchdb_url, db_name, username, password, workers=workers) ####
\ No newline at end of file
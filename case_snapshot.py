@@ -0,0 +1,92 @@
+import logging
+import numpy as np
+import pandas as pd
+
+# pyarrow is optional; without it the snapshot is a NumPy structured array
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+log = logging.getLogger(__name__)
+
+# ------------------------------
+# Columnar snapshot of the ingested cases
+# ------------------------------
+# process_files fills one snapshot per run with the cleaned records and writes it
+# next to the run log, before the downstream stages start.
+# The downstream stages get the path through this environment variable, next to
+# SMART_TRIAGE_LOG_FILE. When it is not set (no snapshot for this run) they read
+# per_cases_to_triage_master from CouchDB as before.
+SNAPSHOT_ENV = "SMART_TRIAGE_CASE_SNAPSHOT"
+SNAPSHOT_COLUMNS = ["Case Number", "Account Name", "Severity", "Mission Team", "Status", "Date/Time Opened"]
+# Low-cardinality text columns, stored dictionary-encoded in the Arrow file
+SNAPSHOT_CATEGORIES = ["Account Name", "Severity", "Mission Team", "Status"]
+
+
+class CaseSnapshot:
+    """Collects the cleaned case records of a run and writes them as one typed, columnar file.
+
+    With pyarrow the file is uncompressed Feather (Arrow IPC), which
+    ``load_case_snapshot`` memory-maps without copying; otherwise it is a ``.npy``
+    structured array loaded with ``mmap_mode="r"``. ``complete`` is cleared when
+    part of the export was not seen by this run (chunks resumed from the ingest
+    journal), since the snapshot would then be missing those cases.
+    """
+
+    def __init__(self):
+        self.rows = []  # one tuple per record; list.append is safe from the ingest threads
+        self.complete = True
+
+    def add(self, record):
+        self.rows.append(tuple(record.get(column) for column in SNAPSHOT_COLUMNS))
+
+    def to_frame(self):
+        df = pd.DataFrame(self.rows, columns=SNAPSHOT_COLUMNS)
+        # A case listed in several exports keeps its last record, as the writes did
+        df = df.drop_duplicates("Case Number", keep="last").reset_index(drop=True)
+        df["Case Number"] = df["Case Number"].astype(str)
+        df["Date/Time Opened"] = pd.to_datetime(df["Date/Time Opened"], format="mixed", errors="coerce")  # "nan" -> NaT
+        for column in SNAPSHOT_CATEGORIES:
+            df[column] = df[column].astype(str).astype("category")
+        return df
+
+    def write(self, path_stem):
+        """Writes the snapshot to ``path_stem`` plus ``.feather`` or ``.npy``; returns the path."""
+        df = self.to_frame()
+        if feather is not None:
+            path = f"{path_stem}.feather"
+            feather.write_feather(df, path, compression="uncompressed")
+        else:
+            path = f"{path_stem}.npy"
+            np.save(path, _to_records(df), allow_pickle=False)
+        log.info(f"Wrote a snapshot of {len(df)} cases to {path}")
+        return path
+
+
+def _to_records(df):
+    fields = []
+    for column in SNAPSHOT_COLUMNS:
+        if column == "Date/Time Opened":
+            fields.append((column, "datetime64[ns]"))
+        else:
+            width = max(1, int(df[column].astype(str).str.len().max() or 1)) if len(df) else 1
+            fields.append((column, f"U{width}"))
+    records = np.empty(len(df), dtype=fields)
+    for column in SNAPSHOT_COLUMNS:
+        values = df[column]
+        records[column] = values.to_numpy("datetime64[ns]") if column == "Date/Time Opened" else values.astype(str).to_numpy()
+    return records
+
+
+def load_case_snapshot(path):
+    """Opens a snapshot written by ``CaseSnapshot.write`` without copying it.
+
+    Returns a ``pyarrow.Table`` for a ``.feather`` file (``.to_pandas()`` converts
+    it) and a read-only memory-mapped NumPy structured array for a ``.npy`` file.
+    """
+    if path.endswith(".feather"):
+        if feather is None:
+            raise ImportError("pyarrow is required to read a .feather case snapshot")
+        return feather.read_table(path, memory_map=True)
+    return np.load(path, mmap_mode="r", allow_pickle=False)
@@ -0,0 +1,203 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from case_queue import is_case_file, process_files
+from ingest_journal import load_retry_queue
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD
+
+# watchdog (inotify on Linux, FSEvents/ReadDirectoryChangesW elsewhere) is optional;
+# without it the folder is polled
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger(__name__)
+
+WATCH_FOLDER = "/Users/Administrator/Downloads/"
+WATCH_POLL_INTERVAL = 5      # seconds between folder scans (a safety net when watchdog is running)
+WATCH_SETTLE_SECONDS = 3     # a download counts as finished once its size and mtime held this long
+WATCH_RETRY_BACKOFF = 60     # first wait (seconds) before a file left in the folder by a failed run is retried
+WATCH_RETRY_MAX_BACKOFF = 3600
+WATCH_QUEUE_INTERVAL = 900   # seconds without a run after which queued failed rows are retried on their own
+
+
+class _WakeOnChange(FileSystemEventHandler):
+    def __init__(self, wake):
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.wake.set()
+
+
+def _readable(path):
+    # The RPA export holds the file open (and locked on Windows) while it is written
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == b"PK\x03\x04"  # every finished .xlsx is a zip archive
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """Hands each new PER export to ``process_files`` as soon as it is fully written.
+
+    Files are picked up from filesystem events when watchdog is installed and by
+    polling otherwise. A file is ready once its size and modification time have
+    not changed for ``settle_seconds`` and it opens as a complete workbook, so a
+    half-downloaded export is never read. Only the ready files are passed to
+    ``process_files`` (``file_names``). The process stays up between files, so
+    the alias cache, the account matcher, the CouchDB connection pool and the
+    indexes set up by the first run are reused.
+
+    A file that is still in the folder after its run (ingest or model stage
+    failed, so it was not archived) is retried with a doubling backoff, and joins
+    any earlier run so its cases are not synced away as missing.
+
+    When no file came in for WATCH_QUEUE_INTERVAL seconds and the retry queue
+    holds rows, ``process_files`` runs without files to retry them.
+    """
+
+    def __init__(self, folder_path, couchdb_url, db_name, username, password,
+                 poll_interval=WATCH_POLL_INTERVAL, settle_seconds=WATCH_SETTLE_SECONDS, **process_kwargs):
+        self.folder_path = folder_path
+        self.process_args = (couchdb_url, db_name, username, password)
+        self.process_kwargs = process_kwargs
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self._seen = {}  # file name -> (size, mtime, monotonic time the pair was first seen)
+        self._retry = {}  # file name -> (size, mtime, failed runs, monotonic time of the next attempt)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._last_run = time.monotonic()
+
+    def _scan(self):
+        """Returns the case files that finished downloading since the last scan."""
+        ready = []
+        now = time.monotonic()
+        present = set()
+        for file_name in os.listdir(self.folder_path):
+            if not is_case_file(file_name) or file_name.startswith("~$"):
+                continue
+            path = os.path.join(self.folder_path, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            present.add(file_name)
+            signature = (stat.st_size, stat.st_mtime)
+            retry = self._retry.get(file_name)
+            if retry is not None:
+                if retry[:2] == signature:
+                    continue  # handled by _due_retries
+                del self._retry[file_name]  # replaced by a new version: settle it like a new file
+            previous = self._seen.get(file_name)
+            if previous is None or previous[:2] != signature:
+                self._seen[file_name] = signature + (now,)
+            elif now - previous[2] >= self.settle_seconds and stat.st_size > 0 and _readable(path):
+                ready.append(file_name)
+        # Forget files that were archived or removed
+        for file_name in set(self._seen) - present:
+            del self._seen[file_name]
+        for file_name in set(self._retry) - present:
+            del self._retry[file_name]
+        return ready
+
+    def _due_retries(self, force=False):
+        now = time.monotonic()
+        return [file_name for file_name, retry in self._retry.items() if force or retry[3] <= now]
+
+    def _queue_pending(self):
+        try:
+            return bool(load_retry_queue(*self.process_args)["rows"])
+        except Exception as e:
+            log.warning(f"Could not read the retry queue: {e}")
+            return False
+
+    def run_once(self):
+        ready = self._scan()
+        # Files waiting for a retry go along with any run, and on their own once their backoff expired
+        ready += self._due_retries(force=bool(ready))
+        if not ready and time.monotonic() - self._last_run >= WATCH_QUEUE_INTERVAL:
+            # Every run retries the queued rows first; without new files they would wait for the next export
+            self._last_run = time.monotonic()
+            if self._queue_pending():
+                log.info("Retrying the queued case rows")
+                try:
+                    process_files(self.folder_path, *self.process_args, file_names=[], **self.process_kwargs)
+                except Exception as e:
+                    log.exception(f"Retrying the queued case rows failed: {e}")
+        if ready:
+            log.info(f"Processing {len(ready)} case file(s): {ready}")
+            self._last_run = time.monotonic()
+            try:
+                process_files(self.folder_path, *self.process_args, file_names=ready, **self.process_kwargs)
+            except Exception as e:
+                log.exception(f"Processing {ready} failed: {e}")
+            for file_name in ready:
+                self._seen.pop(file_name, None)
+                previous = self._retry.pop(file_name, None)
+                try:
+                    stat = os.stat(os.path.join(self.folder_path, file_name))
+                except FileNotFoundError:
+                    continue  # archived
+                failures = previous[2] + 1 if previous else 1
+                backoff = min(WATCH_RETRY_BACKOFF * 2 ** (failures - 1), WATCH_RETRY_MAX_BACKOFF)
+                self._retry[file_name] = (stat.st_size, stat.st_mtime, failures, time.monotonic() + backoff)
+                log.warning(f"'{file_name}' was not archived (attempt {failures}); retrying in {backoff}s")
+        return ready
+
+    def start_observer(self):
+        if Observer is None:
+            log.info(f"watchdog is not installed; polling '{self.folder_path}' every {self.poll_interval}s")
+            return
+        self._observer = Observer()
+        self._observer.schedule(_WakeOnChange(self._wake), self.folder_path, recursive=False)
+        self._observer.start()
+        log.info(f"Watching '{self.folder_path}' for new case files")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run_forever(self):
+        self.start_observer()
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+                # While a download is settling, look again right after the settle window
+                timeout = min(self.poll_interval, self.settle_seconds) if self._seen else self.poll_interval
+                self._wake.wait(timeout)
+                self._wake.clear()
+        finally:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest SCBN New PER exports as soon as they land in the folder.")
+    parser.add_argument("folder", nargs="?", default=WATCH_FOLDER)
+    parser.add_argument("--poll-interval", type=float, default=WATCH_POLL_INTERVAL)
+    parser.add_argument("--settle-seconds", type=float, default=WATCH_SETTLE_SECONDS)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    # process_files replaces the root handlers with its run log and closes them after each run,
+    # so the watcher logs through a handler of its own
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    watcher = FolderWatcher(args.folder, COUCHDB_URL, "per_cases_to_triage_master", COUCHDB_USER, COUCHDB_PASSWORD,
+                            poll_interval=args.poll_interval, settle_seconds=args.settle_seconds, workers=args.workers)
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        watcher.stop()
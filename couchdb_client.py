@@ -0,0 +1,137 @@
+import os
+import json
+import threading
+import couchdb
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+# ------------------------------
+# CouchDB Connection Settings (override through the environment)
+# ------------------------------
+COUCHDB_URL = os.environ.get("COUCHDB_URL", "http://9.20.195.22:5984").rstrip("/")
+COUCHDB_USER = os.environ.get("COUCHDB_USER", "admin")
+COUCHDB_PASSWORD = os.environ.get("COUCHDB_PASSWORD", "admin123")
+
+COUCHDB_TIMEOUT = float(os.environ.get("COUCHDB_TIMEOUT", "30"))      # seconds per request
+COUCHDB_POOL_SIZE = int(os.environ.get("COUCHDB_POOL_SIZE", "16"))    # keep-alive connections per host
+COUCHDB_RETRIES = int(os.environ.get("COUCHDB_RETRIES", "3"))
+COUCHDB_BACKOFF = float(os.environ.get("COUCHDB_BACKOFF", "0.5"))     # 0.5s, 1s, 2s, ...
+
+# Transient server-side failures are retried for the idempotent methods and for the
+# POSTs listed below: the queries, and _bulk_docs, whose pipeline documents all carry
+# their _id (and _rev), so a replay can only conflict. Any other POST (a document
+# created without an _id) is sent once. 409 is not retried because resending the
+# same revision can only conflict again.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_POST_ENDPOINTS = ("_all_docs", "_find", "_explain", "_bulk_docs")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _is_replayable_post(url):
+    path = urlsplit(url or "").path.rstrip("/")
+    return path.rsplit("/", 1)[-1] in RETRY_POST_ENDPOINTS or "/_view/" in path
+
+
+class _CouchRetry(Retry):
+    """Retry that replays a POST only for the endpoints in RETRY_POST_ENDPOINTS and views."""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # A refused connection never reached CouchDB, so it is safe to retry whatever the request
+        if method == "POST" and not _is_replayable_post(url) and not (error and self._is_connection_error(error)):
+            if error:
+                raise error.with_traceback(_stacktrace)
+            raise MaxRetryError(_pool, url, ResponseError(f"{response.status} on a POST that is not replayed"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class _CouchSession(requests.Session):
+    """requests.Session that applies the configured timeout to every call."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", COUCHDB_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def get_session():
+    """Returns the process-wide keep-alive session used for all CouchDB HTTP calls."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = _CouchRetry(
+                total=COUCHDB_RETRIES,
+                backoff_factor=COUCHDB_BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+                raise_on_status=False,
+                respect_retry_after_header=True
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=COUCHDB_POOL_SIZE, max_retries=retry)
+            session = _CouchSession()
+            session.auth = (COUCHDB_USER, COUCHDB_PASSWORD)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def get_server():
+    """Returns a python-couchdb Server on the same configuration (used by app.py and couchdb_XLSX.py)."""
+    delays = [COUCHDB_BACKOFF * (2 ** attempt) for attempt in range(COUCHDB_RETRIES)]
+    server = couchdb.Server(COUCHDB_URL, session=couchdb.http.Session(timeout=COUCHDB_TIMEOUT, retry_delays=delays))
+    server.resource.credentials = (COUCHDB_USER, COUCHDB_PASSWORD)
+    return server
+
+
+# ------------------------------
+# Streaming, paginated view reads
+# ------------------------------
+VIEW_PAGE_SIZE = int(os.environ.get("COUCHDB_VIEW_PAGE_SIZE", "1000"))
+
+
+def _parse_rows(response):
+    """Yields the rows of a view response one line at a time.
+
+    CouchDB writes every row of ``_all_docs`` and view responses on its own line,
+    so a page is decoded row by row instead of holding the whole body; a response
+    that arrives on a single line is decoded in one go.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        line = line.strip()
+        if line.startswith('{"id"') or line.startswith('{"key"'):
+            yield json.loads(line.rstrip(","))
+        elif line.startswith("{") and line.endswith("}"):
+            yield from json.loads(line).get("rows", [])
+
+
+def iter_view_rows(url, params=None, auth=None, page_size=VIEW_PAGE_SIZE):
+    """Lazily yields every row of the ``_all_docs`` or view at ``url``, ``page_size`` rows per request.
+
+    Pages are chained with startkey/startkey_docid, so memory stays bounded by one
+    page whatever the size of the database.
+    """
+    session = get_session()
+    params = dict(params or {})
+    while True:
+        page = dict(params, limit=page_size + 1)
+        response = session.get(url, params=page, auth=auth, stream=True)
+        try:
+            response.raise_for_status()
+            count = 0
+            last = None
+            for row in _parse_rows(response):
+                count += 1
+                if count > page_size:
+                    last = row
+                    break
+                yield row
+        finally:
+            response.close()
+        if last is None:
+            return
+        params["startkey"] = json.dumps(last["key"])
+        params["startkey_docid"] = last["id"]
@@ -0,0 +1,145 @@
+import logging
+from requests.auth import HTTPBasicAuth
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD, get_session
+
+log = logging.getLogger(__name__)
+session = get_session()
+
+# ------------------------------
+# Mango indexes required by the pipeline
+# ------------------------------
+# One JSON index per field the pipeline queries with a Mango selector:
+#   user_aliases                          salesforce_name (alias lookup), user_name (couchdb_XLSX.py)
+#   per_cases_to_triage_master            "Case Number" (check_case_exists and downstream stages)
+#   per_account_distribution_sheet_master "Account Name" (find_existing_doc in new file.py)
+#   per_sme_master                        "Document Type" (find_existing_doc in new file.py)
+REQUIRED_INDEXES = {
+    "user_aliases": [
+        {"name": "salesforce_name-idx", "fields": ["salesforce_name"]},
+        {"name": "user_name-idx", "fields": ["user_name"]},
+    ],
+    "per_cases_to_triage_master": [
+        {"name": "case_number-idx", "fields": ["Case Number"]},
+    ],
+    "per_account_distribution_sheet_master": [
+        {"name": "account_name-idx", "fields": ["Account Name"]},
+    ],
+    "per_sme_master": [
+        {"name": "document_type-idx", "fields": ["Document Type"]},
+    ],
+}
+
+
+# ------------------------------
+# Views required by the pipeline
+# ------------------------------
+# Design documents whose views project only the fields a reader needs:
+#   per_account_distribution_sheet_master  _design/accounts/_view/names  (doc id -> "Account Name")
+#   user_aliases                           _design/aliases/_view/by_canonical_key  (canonical_key -> user_name)
+REQUIRED_VIEWS = {
+    "user_aliases": {
+        "_design/aliases": {
+            "language": "javascript",
+            "views": {
+                "by_canonical_key": {
+                    "map": "function (doc) { if (doc.canonical_key) { emit(doc.canonical_key, doc.user_name || null); } }"
+                }
+            }
+        }
+    },
+    "per_account_distribution_sheet_master": {
+        "_design/accounts": {
+            "language": "javascript",
+            "views": {
+                "names": {
+                    "map": "function (doc) { if (doc['Account Name']) { emit(doc._id, doc['Account Name'].trim()); } }"
+                }
+            }
+        }
+    }
+}
+
+
+def _auth(username, password):
+    # Without explicit credentials the shared session's configured ones apply
+    return HTTPBasicAuth(username, password) if username else None
+
+
+def ensure_indexes(couchdb_url, db_name, username, password):
+    """Creates the declared indexes of ``db_name`` that do not exist yet; returns their names."""
+    db_url = f"{couchdb_url.rstrip('/')}/{db_name}"
+    auth = _auth(username, password)
+
+    response = session.get(f"{db_url}/_index", auth=auth)
+    response.raise_for_status()
+    existing = {index["name"] for index in response.json().get("indexes", [])}
+
+    created = []
+    for index in REQUIRED_INDEXES.get(db_name, []):
+        if index["name"] in existing:
+            continue
+        body = {
+            "index": {"fields": index["fields"]},
+            "name": index["name"],
+            "ddoc": index["name"],
+            "type": "json"
+        }
+        response = session.post(f"{db_url}/_index", json=body, auth=auth)
+        if response.status_code not in (200, 201):
+            raise Exception(f"Failed to create index '{index['name']}' on '{db_name}': {response.status_code}, {response.text}")
+        created.append(index["name"])
+        log.info(f"Created index '{index['name']}' on '{db_name}'")
+    return created
+
+
+def ensure_views(couchdb_url, db_name, username, password):
+    """Creates or updates the declared design documents of ``db_name``; returns the ones written."""
+    db_url = f"{couchdb_url.rstrip('/')}/{db_name}"
+    auth = _auth(username, password)
+
+    written = []
+    for ddoc_id, ddoc in REQUIRED_VIEWS.get(db_name, {}).items():
+        response = session.get(f"{db_url}/{ddoc_id}", auth=auth)
+        body = dict(ddoc)
+        if response.status_code == 200:
+            current = response.json()
+            if current.get("views") == ddoc["views"]:
+                continue
+            body["_rev"] = current["_rev"]
+        elif response.status_code != 404:
+            response.raise_for_status()
+        response = session.put(f"{db_url}/{ddoc_id}", json=body, auth=auth)
+        if response.status_code not in (200, 201):
+            raise Exception(f"Failed to write '{ddoc_id}' on '{db_name}': {response.status_code}, {response.text}")
+        written.append(ddoc_id)
+        log.info(f"Wrote view '{ddoc_id}' on '{db_name}'")
+    return written
+
+
+def check_query_plan(couchdb_url, db_name, username, password, selector):
+    """Runs ``_explain`` for ``selector`` and warns when CouchDB would fall back to a full scan."""
+    db_url = f"{couchdb_url.rstrip('/')}/{db_name}"
+    response = session.post(f"{db_url}/_explain", json={"selector": selector}, auth=_auth(username, password))
+    response.raise_for_status()
+    index = response.json().get("index", {})
+    if index.get("type") == "special":
+        log.warning(f"Query on '{db_name}' with selector {selector} is not using an index (full scan of {index.get('name')})")
+        return False
+    return True
+
+
+def bootstrap_indexes(couchdb_url, username, password, db_names=None):
+    """Ensures the declared indexes and views exist and that every declared field query uses an index."""
+    for db_name in db_names or REQUIRED_INDEXES:
+        ensure_indexes(couchdb_url, db_name, username, password)
+        ensure_views(couchdb_url, db_name, username, password)
+        for index in REQUIRED_INDEXES.get(db_name, []):
+            check_query_plan(couchdb_url, db_name, username, password, {index["fields"][0]: {"$eq": ""}})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    couchdb_url = COUCHDB_URL
+    username = COUCHDB_USER
+    password = COUCHDB_PASSWORD
+    bootstrap_indexes(couchdb_url, username, password)
@@ -0,0 +1,194 @@
+import re
+import sys
+import unicodedata
+from urllib.parse import quote
+from requests.auth import HTTPBasicAuth
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD, get_session
+
+# ------------------------------
+# Deterministic document IDs
+# ------------------------------
+# Every pipeline database is keyed on its natural key so lookups are primary-key
+# fetches instead of Mango scans:
+#   per_cases_to_triage_master            -> case:<Case Number>
+#   user_aliases                          -> alias:<normalized salesforce_name>
+#   per_account_distribution_sheet_master -> account:<Account Name>
+
+CASE_PREFIX = "case:"
+ALIAS_PREFIX = "alias:"
+ACCOUNT_PREFIX = "account:"
+
+
+def normalize_alias_name(name):
+    """Whitespace-collapsed, case-folded salesforce_name (the uniqueness key)."""
+    return " ".join(str(name or "").split()).casefold()
+
+
+# Trailing legal-form words dropped by canonical_alias_key ("Acme Corp." and "ACME Corporation" -> "acme")
+LEGAL_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "llc", "llp", "lp", "ltd", "limited",
+    "plc", "gmbh", "ag", "sa", "sas", "srl", "spa", "bv", "nv", "pty", "pvt", "kk", "oy", "ab",
+}
+
+
+def canonical_alias_key(name):
+    """Lookup key of a salesforce_name that ignores case, spacing, punctuation and legal suffixes.
+
+    The text is NFKC-normalized and case-folded; '.' and apostrophes are dropped
+    (so "S.A." reads as "sa"), other punctuation separates words, '&' reads as
+    "and", and trailing legal-form words are removed while a word remains.
+    """
+    text = unicodedata.normalize("NFKC", str(name or "")).casefold()
+    text = re.sub(r"[.'’]", "", text.replace("&", " and "))
+    words = re.sub(r"[\W_]+", " ", text).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+        if len(words) > 1 and words[-1] == "and":  # "Smith & Co"
+            words.pop()
+    return " ".join(words)
+
+
+def case_doc_id(case_number):
+    return f"{CASE_PREFIX}{str(case_number).strip()}"
+
+
+def alias_doc_id(salesforce_name):
+    return f"{ALIAS_PREFIX}{normalize_alias_name(salesforce_name)}"
+
+
+def account_doc_id(account_name):
+    return f"{ACCOUNT_PREFIX}{str(account_name).strip()}"
+
+
+def doc_url(db_url, doc_id):
+    """URL of a single document; IDs may contain '/', '#', '?' and spaces."""
+    return f"{db_url}/{quote(doc_id, safe='')}"
+
+
+def _alias_id_for(doc):
+    name = doc.get("salesforce_name")
+    if not name:
+        names = doc.get("salesforce_names", [])
+        name = names[0] if isinstance(names, list) and names else None
+    return alias_doc_id(name) if name and str(name).strip() else None
+
+
+def _case_id_for(doc):
+    number = doc.get("Case Number")
+    return case_doc_id(number) if number is not None and str(number).strip() else None
+
+
+def _account_id_for(doc):
+    name = doc.get("Account Name")
+    return account_doc_id(name) if name and str(name).strip() else None
+
+
+DOC_ID_FUNCTIONS = {
+    "per_cases_to_triage_master": _case_id_for,
+    "user_aliases": _alias_id_for,
+    "per_account_distribution_sheet_master": _account_id_for,
+}
+
+
+# ------------------------------
+# Migration of existing databases
+# ------------------------------
+def migrate_to_deterministic_ids(couchdb_url, db_name, username, password, batch_size=500):
+    """Re-keys legacy (random UUID) documents of ``db_name`` onto deterministic IDs.
+
+    Each legacy document is copied to its new ID and the old revision is deleted
+    only after the copy was written. Documents whose new ID is already taken
+    (an existing keyed doc or an earlier legacy duplicate) are left in place and
+    reported as collisions so they can be merged by hand.
+    """
+    id_for = DOC_ID_FUNCTIONS[db_name]
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+    session = get_session()
+
+    response = session.get(f"{db_url}/_all_docs", params={"include_docs": "true"}, auth=auth)
+    response.raise_for_status()
+    docs = [row["doc"] for row in response.json().get("rows", []) if not row["id"].startswith("_design/")]
+
+    taken = {doc["_id"] for doc in docs}
+    summary = {"migrated": 0, "already_keyed": 0, "skipped": [], "collisions": [], "errors": []}
+    moves = []
+    for doc in docs:
+        new_id = id_for(doc)
+        if new_id is None:
+            summary["skipped"].append(doc["_id"])
+        elif new_id == doc["_id"]:
+            summary["already_keyed"] += 1
+        elif new_id in taken:
+            summary["collisions"].append({"id": doc["_id"], "target": new_id})
+        else:
+            taken.add(new_id)
+            moves.append((doc, new_id))
+
+    for start in range(0, len(moves), batch_size):
+        chunk = moves[start:start + batch_size]
+        copies = []
+        for doc, new_id in chunk:
+            copy = {k: v for k, v in doc.items() if k not in ("_id", "_rev")}
+            copy["_id"] = new_id
+            copies.append(copy)
+        response = session.post(f"{db_url}/_bulk_docs", json={"docs": copies}, auth=auth)
+        response.raise_for_status()
+
+        deletions = []
+        for (doc, new_id), outcome in zip(chunk, response.json()):
+            if "error" in outcome:
+                summary["errors"].append({"id": doc["_id"], "target": new_id, "error": outcome["error"]})
+            else:
+                deletions.append({"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True})
+        if deletions:
+            response = session.post(f"{db_url}/_bulk_docs", json={"docs": deletions}, auth=auth)
+            response.raise_for_status()
+            for outcome in response.json():
+                if "error" in outcome:
+                    summary["errors"].append({"id": outcome.get("id"), "error": outcome["error"]})
+                else:
+                    summary["migrated"] += 1
+    return summary
+
+
+def backfill_canonical_keys(couchdb_url, username, password, db_name="user_aliases", batch_size=500):
+    """Sets ``canonical_key`` on every alias document that lacks it or carries a stale one; returns the count."""
+    db_url = f"{couchdb_url}/{db_name}"
+    auth = HTTPBasicAuth(username, password)
+    session = get_session()
+
+    response = session.get(f"{db_url}/_all_docs", params={"include_docs": "true"}, auth=auth)
+    response.raise_for_status()
+    updates = []
+    for row in response.json().get("rows", []):
+        doc = row.get("doc")
+        if not doc or row["id"].startswith("_design/"):
+            continue
+        name = doc.get("salesforce_name") or next(iter(doc.get("salesforce_names") or []), None)
+        key = canonical_alias_key(name)
+        if name and doc.get("canonical_key") != key:
+            updates.append(dict(doc, canonical_key=key))
+
+    written = 0
+    for start in range(0, len(updates), batch_size):
+        response = session.post(f"{db_url}/_bulk_docs", json={"docs": updates[start:start + batch_size]}, auth=auth)
+        response.raise_for_status()
+        written += sum(1 for outcome in response.json() if "error" not in outcome)
+    return written
+
+
+if __name__ == "__main__":
+    couchdb_url = COUCHDB_URL
+    username = COUCHDB_USER
+    password = COUCHDB_PASSWORD
+    db_names = sys.argv[1:] or list(DOC_ID_FUNCTIONS)
+
+    for db_name in db_names:
+        result = migrate_to_deterministic_ids(couchdb_url, db_name, username, password)
+        print(f"{db_name}: migrated {result['migrated']}, already keyed {result['already_keyed']}, "
+              f"skipped {len(result['skipped'])}, collisions {len(result['collisions'])}, errors {len(result['errors'])}")
+        for collision in result["collisions"]:
+            print(f"  collision: {collision['id']} -> {collision['target']}")
+        if db_name == "user_aliases":
+            print(f"{db_name}: canonical_key set on {backfill_canonical_keys(couchdb_url, username, password)} documents")
@@ -0,0 +1,153 @@
+import hashlib
+import logging
+from requests.auth import HTTPBasicAuth
+from couchdb_client import get_session
+
+log = logging.getLogger(__name__)
+
+# ------------------------------
+# Ingest progress journal
+# ------------------------------
+# Progress is kept in _local documents of the triage database: they are not
+# replicated, do not show up in _all_docs/_changes, and go away with the database
+# on a full reload, which is exactly when the progress no longer applies.
+#   _local/ingest-file-<sha256 of the workbook>  chunks committed for one export
+#   _local/ingest-retry-queue                    rows that failed and are retried next run
+# A rerun after a crash resumes each export after its last committed chunk, and
+# process_files retries the queued rows before ingesting the exports of the run.
+JOURNAL_PREFIX = "_local/ingest-file-"
+RETRY_QUEUE_ID = "_local/ingest-retry-queue"
+RETRY_MAX_ATTEMPTS = 5
+
+
+def file_content_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _local_url(couchdb_url, db_name, doc_id):
+    # _local IDs here are a fixed prefix plus a hex digest, so they need no quoting
+    return f"{couchdb_url}/{db_name}/{doc_id}"
+
+
+def _get_local(couchdb_url, db_name, username, password, doc_id):
+    response = get_session().get(_local_url(couchdb_url, db_name, doc_id), auth=HTTPBasicAuth(username, password))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def _put_local(couchdb_url, db_name, username, password, doc):
+    response = get_session().put(_local_url(couchdb_url, db_name, doc["_id"]), json=doc, auth=HTTPBasicAuth(username, password))
+    response.raise_for_status()
+    doc["_rev"] = response.json().get("rev")
+
+
+class IngestJournal:
+    """Checkpoint of one PER export, identified by the hash of its contents.
+
+    ``chunks_done`` counts the row chunks of ``chunk_size`` rows whose writes
+    were committed; a rerun of the same workbook skips those chunks, and a
+    workbook whose status is "complete" is not ingested again. An edited
+    workbook has a new hash and starts from its first row.
+
+    The rows of a chunk that failed are stored with its checkpoint, so they reach
+    the retry queue even when the run dies before saving it; they are cleared
+    once the queue holding them was saved.
+    """
+
+    def __init__(self, couchdb_url, db_name, username, password, file_name, content_hash):
+        self.couchdb_url = couchdb_url
+        self.db_name = db_name
+        self.username = username
+        self.password = password
+        self.file_name = file_name
+        self.content_hash = content_hash
+        self.doc = {"_id": f"{JOURNAL_PREFIX}{content_hash}", "file_name": file_name, "content_hash": content_hash,
+                    "chunks_done": 0, "status": "pending"}
+
+    @classmethod
+    def for_file(cls, couchdb_url, db_name, username, password, file_path, file_name, chunk_size):
+        journal = cls(couchdb_url, db_name, username, password, file_name, file_content_hash(file_path))
+        journal.doc["chunk_size"] = chunk_size
+        stored = _get_local(couchdb_url, db_name, username, password, journal.doc["_id"])
+        if stored:
+            journal.doc = stored
+            if stored.get("status") != "complete" and stored.get("chunk_size") != chunk_size:
+                # Chunk numbers only line up when the workbook is cut the same way
+                journal.doc.update({"chunks_done": 0, "chunk_size": chunk_size})
+        return journal
+
+    @property
+    def chunks_done(self):
+        return self.doc.get("chunks_done", 0)
+
+    @property
+    def failed_rows(self):
+        return self.doc.get("failed_rows", [])
+
+    @property
+    def complete(self):
+        return self.doc.get("status") == "complete"
+
+    def _save(self):
+        _put_local(self.couchdb_url, self.db_name, self.username, self.password, self.doc)
+
+    def checkpoint(self, chunks_done, failed_rows=()):
+        self.doc.update({"chunks_done": chunks_done, "status": "partial", "file_name": self.file_name,
+                         "failed_rows": self.failed_rows + list(failed_rows)})
+        self._save()
+
+    def clear_failed_rows(self):
+        """Forgets the failed rows once the retry queue holding them was saved."""
+        if self.failed_rows:
+            self.doc["failed_rows"] = []
+            self._save()
+
+    def mark_complete(self):
+        self.doc["status"] = "complete"
+        self._save()
+
+    def discard(self):
+        """Drops the checkpoint once the workbook has been archived."""
+        if "_rev" not in self.doc:
+            return
+        url = _local_url(self.couchdb_url, self.db_name, self.doc["_id"])
+        response = get_session().delete(url, params={"rev": self.doc["_rev"]}, auth=HTTPBasicAuth(self.username, self.password))
+        if response.status_code not in (200, 404):
+            log.warning(f"Could not drop the ingest journal of '{self.file_name}': {response.status_code}, {response.text}")
+
+
+# ------------------------------
+# Retry queue of failed rows
+# ------------------------------
+def load_retry_queue(couchdb_url, db_name, username, password):
+    """Returns the queue document; its ``rows`` are dicts with the row fields, file_name, error and attempts."""
+    doc = _get_local(couchdb_url, db_name, username, password, RETRY_QUEUE_ID)
+    return doc or {"_id": RETRY_QUEUE_ID, "rows": []}
+
+
+def merge_retry_rows(rows, extra_rows):
+    """``rows`` plus the entries of ``extra_rows`` for rows (file and row number) not queued yet."""
+    queued = {(entry.get("file_name"), entry.get("row_number")) for entry in rows}
+    return list(rows) + [entry for entry in extra_rows if (entry.get("file_name"), entry.get("row_number")) not in queued]
+
+
+def save_retry_queue(couchdb_url, db_name, username, password, queue, rows):
+    """Stores ``rows`` as the new queue, dropping rows that used up RETRY_MAX_ATTEMPTS."""
+    kept = []
+    for entry in rows:
+        if entry.get("attempts", 0) >= RETRY_MAX_ATTEMPTS:
+            log.error(f"Giving up on case {entry.get('case_number')} from '{entry.get('file_name')}' after "
+                      f"{entry['attempts']} attempts: {entry.get('error')}")
+        else:
+            kept.append(entry)
+    if not kept and "_rev" not in queue:
+        return queue
+    queue["rows"] = kept
+    _put_local(couchdb_url, db_name, username, password, queue)
+    return queue
@@ -1,7 +1,18 @@
 import openpyxl
-import requests
 import json
 from pathlib import Path
+from doc_ids import ACCOUNT_PREFIX, account_doc_id, doc_url
+from couchdb_schema import bootstrap_indexes
+from ingest_journal import file_content_hash
+from couchdb_client import COUCHDB_URL, COUCHDB_USER, COUCHDB_PASSWORD, get_session, iter_view_rows
+
+session = get_session()
+
+ACCOUNT_DB_NAME = "per_account_distribution_sheet_master"
+SME_DB_NAME = "per_sme_master"
+ACCOUNT_BULK_CHUNK_SIZE = 500
+# Content hash of the last workbook imported; a _local doc, so it goes away with the database
+ACCOUNT_IMPORT_STATE_ID = "_local/account-sheet-import"
 
 def clean_name(name):
     return name.strip()
@@ -9,6 +20,8 @@ def clean_name(name):
 def get_email_lookup(mapping_sheet):
     email_lookup = {}
     for row in mapping_sheet.iter_rows(min_row=2, values_only=True):
+        # Read-only sheets drop trailing empty cells, so a row without an email is padded to column B
+        row = tuple(row) + (None,) * (2 - len(row))
         name, email = row[0], row[1]
         if name and email:
             email_lookup[clean_name(name)] = email.strip()
@@ -17,6 +30,8 @@ def get_email_lookup(mapping_sheet):
 def process_account_names_sheet(sheet, email_lookup):
     data_to_post = []
     for row in sheet.iter_rows(min_row=2, values_only=True):
+        # Read-only sheets drop trailing empty cells, so short rows are padded to column G
+        row = tuple(row) + (None,) * (7 - len(row))
         account_name = row[0]
         account_lead = row[5]  # Column F
         sme_pool_raw = row[6]  # Column G
@@ -39,20 +54,22 @@ def process_account_names_sheet(sheet, email_lookup):
         data_to_post.append(json_obj)
     return data_to_post
 
-def get_unique_smes(mapping_sheet):
-    sme_data = {}
-    for row in mapping_sheet.iter_rows(min_row=2, values_only=True):
-        name, email = row[0], row[1]
-        if name and email:
-            cleaned_name = clean_name(name)
-            sme_data[cleaned_name] = email.strip()
-    return sme_data
+def read_distribution_workbook(file_path):
+    """Streams the Mapping and Account Names sheets once; returns ``(sme email lookup, account docs)``."""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        # The SME master and the account e-mails come from the same name -> e-mail mapping
+        email_lookup = get_email_lookup(wb["Mapping"])
+        data_to_post = process_account_names_sheet(wb["Account Names"], email_lookup)
+    finally:
+        wb.close()
+    return email_lookup, data_to_post
 
 def ensure_db_exists(couchdb_url, db_name, username, password):
     db_url = f"{couchdb_url}/{db_name}"
-    response = requests.get(db_url, auth=(username, password))
+    response = session.get(db_url, auth=(username, password))
     if response.status_code == 404:
-        create_response = requests.put(db_url, auth=(username, password))
+        create_response = session.put(db_url, auth=(username, password))
         if create_response.status_code not in (200, 201):
             raise Exception(f"Failed to create database '{db_name}', Status: {create_response.status_code}, Error: {create_response.text}")
     elif response.status_code not in (200, 201):
@@ -67,7 +84,7 @@ def find_existing_doc(couchdb_url, db_name, username, password, key, value):
         },
         "limit": 1
     }
-    response = requests.post(url, auth=(username, password), headers=headers, data=json.dumps(query))
+    response = session.post(url, auth=(username, password), headers=headers, data=json.dumps(query))
     if response.status_code == 200:
         result = response.json()
         docs = result.get("docs", [])
@@ -75,29 +92,126 @@ def find_existing_doc(couchdb_url, db_name, username, password, key, value):
             return docs[0]
     return None
 
-def post_or_update_to_couchdb(couchdb_url, db_name, username, password, data_list, key_field):
+def get_doc_by_id(couchdb_url, db_name, username, password, doc_id):
+    response = session.get(doc_url(f"{couchdb_url}/{db_name}", doc_id), auth=(username, password))
+    if response.status_code == 200:
+        return response.json()
+    return None
+
+def post_or_update_to_couchdb(couchdb_url, db_name, username, password, data_list, key_field, id_func=None):
+    # With id_func the document ID is derived from the key field, so the lookup is a primary-key GET
     for data in data_list:
-        existing_doc = find_existing_doc(couchdb_url, db_name, username, password, key_field, data[key_field])
+        if id_func:
+            data["_id"] = id_func(data[key_field])
+            existing_doc = get_doc_by_id(couchdb_url, db_name, username, password, data["_id"])
+        else:
+            existing_doc = find_existing_doc(couchdb_url, db_name, username, password, key_field, data[key_field])
         if existing_doc:
             data["_id"], data["_rev"] = existing_doc["_id"], existing_doc["_rev"]
-            update_url = f"{couchdb_url}/{db_name}/{existing_doc['_id']}"
-            response = requests.put(update_url, auth=(username, password), headers={"Content-Type": "application/json"}, data=json.dumps(data))
+            update_url = doc_url(f"{couchdb_url}/{db_name}", existing_doc["_id"])
+            response = session.put(update_url, auth=(username, password), headers={"Content-Type": "application/json"}, data=json.dumps(data))
             if response.status_code in (200, 201):
                 print(f"Updated document: {data[key_field]}")
             else:
                 print(f"Failed to update: {data[key_field]}, Status: {response.status_code}, Error: {response.text}")
         else:
             post_url = f"{couchdb_url}/{db_name}"
-            response = requests.post(post_url, auth=(username, password), headers={"Content-Type": "application/json"}, data=json.dumps(data))
+            response = session.post(post_url, auth=(username, password), headers={"Content-Type": "application/json"}, data=json.dumps(data))
             if response.status_code in (200, 201):
                 print(f"Created new document: {data[key_field]}")
             else:
                 print(f"Failed to create: {data[key_field]}, Status: {response.status_code}, Error: {response.text}")
 
+# ------------------------------
+# Bulk account sync
+# ------------------------------
+def load_account_docs(couchdb_url, db_name, username, password):
+    """One paged read of every account document, keyed by ID."""
+    params = {"include_docs": "true", "startkey": json.dumps(ACCOUNT_PREFIX), "endkey": json.dumps(ACCOUNT_PREFIX + "\ufff0")}
+    rows = iter_view_rows(f"{couchdb_url}/{db_name}/_all_docs", params, auth=(username, password))
+    return {row["id"]: row["doc"] for row in rows if row.get("doc")}
+
+def plan_account_writes(data_list, existing_docs, key_field="Account Name", id_func=account_doc_id):
+    """Documents of ``data_list`` that are new or differ from ``existing_docs``, with ``_rev`` set for updates."""
+    by_id = {}
+    for data in data_list:
+        by_id[id_func(data[key_field])] = data  # a name listed twice keeps its last row, as the PUT loop did
+    writes = []
+    for doc_id, data in by_id.items():
+        existing = existing_docs.get(doc_id)
+        if existing and {k: v for k, v in existing.items() if k not in ("_id", "_rev")} == data:
+            continue
+        doc = dict(data, _id=doc_id)
+        if existing:
+            doc["_rev"] = existing["_rev"]
+        writes.append(doc)
+    return writes
+
+def bulk_save(couchdb_url, db_name, username, password, docs, key_field, chunk_size=ACCOUNT_BULK_CHUNK_SIZE):
+    """Writes ``docs`` through _bulk_docs ``chunk_size`` at a time; returns the number that failed."""
+    failed = 0
+    for start in range(0, len(docs), chunk_size):
+        chunk = docs[start:start + chunk_size]
+        response = session.post(f"{couchdb_url}/{db_name}/_bulk_docs", auth=(username, password), json={"docs": chunk})
+        if response.status_code not in (200, 201):
+            print(f"Failed to write {len(chunk)} documents, Status: {response.status_code}, Error: {response.text}")
+            failed += len(chunk)
+            continue
+        for doc, result in zip(chunk, response.json()):
+            if result.get("error"):
+                print(f"Failed to write: {doc[key_field]}, Error: {result['error']} {result.get('reason', '')}")
+                failed += 1
+            else:
+                print(f"{'Updated' if '_rev' in doc else 'Created new'} document: {doc[key_field]}")
+    return failed
+
+def get_import_state(couchdb_url, db_name, username, password):
+    response = session.get(f"{couchdb_url}/{db_name}/{ACCOUNT_IMPORT_STATE_ID}", auth=(username, password))
+    if response.status_code == 200:
+        return response.json()
+    return {"_id": ACCOUNT_IMPORT_STATE_ID}
+
+def save_import_state(couchdb_url, db_name, username, password, state):
+    response = session.put(f"{couchdb_url}/{db_name}/{ACCOUNT_IMPORT_STATE_ID}", auth=(username, password), json=state)
+    if response.status_code not in (200, 201):
+        print(f"Could not record the import of {state.get('file_name')}: {response.status_code}, {response.text}")
+
+def import_distribution_workbook(file_path, couchdb_url, username, password):
+    """Loads one Account Distribution Sheet; returns False if any document failed to write.
+
+    A workbook whose content hash matches the last import is not read again.
+    """
+    content_hash = file_content_hash(file_path)
+    state = get_import_state(couchdb_url, ACCOUNT_DB_NAME, username, password)
+    if state.get("content_hash") == content_hash:
+        print(f"{file_path.name} is unchanged since the last import; skipping")
+        return True
+
+    email_lookup, data_to_post = read_distribution_workbook(file_path)
+
+    sme_master_data = {
+        "Document Type": "SME Master",
+        "SMEs": email_lookup
+    }
+    post_or_update_to_couchdb(couchdb_url, SME_DB_NAME, username, password, [sme_master_data], "Document Type")
+
+    existing_docs = load_account_docs(couchdb_url, ACCOUNT_DB_NAME, username, password)
+    writes = plan_account_writes(data_to_post, existing_docs)
+    print(f"{len(data_to_post)} accounts read, {len(writes)} new or changed")
+    failed = bulk_save(couchdb_url, ACCOUNT_DB_NAME, username, password, writes, "Account Name")
+    if failed:
+        print(f"{failed} account documents failed to write")
+        return False
+
+    state.update({"content_hash": content_hash, "file_name": file_path.name, "accounts": len(data_to_post)})
+    save_import_state(couchdb_url, ACCOUNT_DB_NAME, username, password, state)
+    return True
+
 def process_files_in_folder(folder_path, couchdb_url, username, password):
     # Ensure both databases exist
-    ensure_db_exists(couchdb_url, "per_account_distribution_sheet_master", username, password)
-    ensure_db_exists(couchdb_url, "per_sme_master", username, password)
+    ensure_db_exists(couchdb_url, ACCOUNT_DB_NAME, username, password)
+    ensure_db_exists(couchdb_url, SME_DB_NAME, username, password)
+    bootstrap_indexes(couchdb_url, username, password, [ACCOUNT_DB_NAME, SME_DB_NAME])
     xlsx_files = list(folder_path.glob("*.xlsx"))
 
     if not xlsx_files:
@@ -106,26 +220,9 @@ def process_files_in_folder(folder_path, couchdb_url, username, password):
         for file_path in xlsx_files:
             try:
                 print(f"Processing file: {file_path.name}")
-                wb = openpyxl.load_workbook(file_path, data_only=True)
-
-                account_names_sheet = wb["Account Names"]
-                mapping_sheet = wb["Mapping"]
-
-                # Process SME mapping
-                email_lookup = get_email_lookup(mapping_sheet)
-                sme_data = get_unique_smes(mapping_sheet)
-        
-                sme_master_data = {
-                    "Document Type": "SME Master",
-                    "SMEs": sme_data
-                }
-                post_or_update_to_couchdb(couchdb_url, "per_sme_master", username, password, [sme_master_data], "Document Type")
-
-                # Process account names
-                data_to_post = process_account_names_sheet(account_names_sheet, email_lookup)
-                post_or_update_to_couchdb(couchdb_url, "per_account_distribution_sheet_master", username, password, data_to_post, "Account Name")
-
-                wb.close()
+                if not import_distribution_workbook(file_path, couchdb_url, username, password):
+                    print(f"Keeping {file_path.name} for the next run\n")
+                    continue
                 file_path.unlink()
                 print(f"Successfully processed and deleted: {file_path.name}\n")
 
@@ -133,10 +230,10 @@ def process_files_in_folder(folder_path, couchdb_url, username, password):
                 print(f"Error processing {file_path.name}: {e}")
 
 if __name__ == "__main__":
-    couchdb_url = "http://9.20.195.22:5984"
+    couchdb_url = COUCHDB_URL
     # db_name = "per_account_distribution_sheet_master"
-    username = "admin"
-    password = "admin123"
+    username = COUCHDB_USER
+    password = COUCHDB_PASSWORD
     script_dir = Path(__file__).resolve().parent
     #folder_path = "/Users/lavanyam/Downloads/Smart Triage Final"
     folder_path = script_dir / "PER Account Distribution Sheet"
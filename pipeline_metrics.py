@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "total_seconds": round(self.sum, 6),
+            "mean_seconds": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max_seconds": round(self.max, 6),
+            "buckets": {str(bound): sum(self.counts[:i + 1]) for i, bound in enumerate(self.buckets)},
+        }
+
+
+def _endpoint(url):
+    """Groups CouchDB URLs by the API they hit (_bulk_docs, _all_docs, a view, a document, ...)."""
+    parts = [part for part in urlparse(url).path.split("/") if part]
+    if len(parts) <= 1:
+        return "database" if parts else "server"
+    if parts[1] == "_design":
+        return "view" if "_view" in parts else "design"
+    return parts[1] if parts[1].startswith("_") else "document"
+
+
+class RunMetrics:
+    """Timings, counters and gauges of one pipeline run.
+
+    ``timer(name)`` records a latency histogram per stage name (Excel parse, alias
+    lookup, CouchDB write, downstream scripts), ``incr`` counts rows and outcomes
+    and ``install_http_hook`` adds a histogram per CouchDB endpoint. The run is
+    exported as a JSON summary and, optionally, in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.timers = {}
+            self.counters = {}
+            self.gauges = {}
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.timers.setdefault(name, Histogram()).observe(seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def install_http_hook(self, session):
+        """Counts every response of ``session`` and records its latency per method and endpoint."""
+        if getattr(session, "_run_metrics_hook", None) is not None:
+            return
+
+        def record(response, *args, **kwargs):
+            name = f"http.{response.request.method}.{_endpoint(response.url)}"
+            self.observe(name, response.elapsed.total_seconds())
+            self.incr(f"http.status.{response.status_code}")
+            return response
+
+        session.hooks["response"].append(record)
+        session._run_metrics_hook = record
+
+    def summary(self):
+        with self._lock:
+            wall = time.time() - self.started
+            summary = {
+                "started": self.started,
+                "wall_seconds": round(wall, 3),
+                "timers": {name: histogram.to_json() for name, histogram in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+        rows = summary["counters"].get("rows.read", 0)
+        ingest = summary["timers"].get("ingest", {}).get("total_seconds", 0.0)
+        summary["rows_per_second"] = round(rows / ingest, 2) if ingest else 0.0
+        summary["http_calls"] = sum(count for name, count in summary["counters"].items() if name.startswith("http.status."))
+        return summary
+
+    def to_prometheus(self, prefix="smart_triage"):
+        summary = self.summary()
+        lines = []
+
+        def label_name(name):
+            return name.replace('"', "'")
+
+        lines.append(f"# TYPE {prefix}_duration_seconds histogram")
+        with self._lock:
+            timers = sorted(self.timers.items())
+        for name, histogram in timers:
+            label = label_name(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_duration_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_duration_seconds_bucket{{stage="{label}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_duration_seconds_sum{{stage="{label}"}} {histogram.sum}')
+            lines.append(f'{prefix}_duration_seconds_count{{stage="{label}"}} {histogram.count}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'{prefix}_events_total{{name="{label_name(name)}"}} {value}')
+        lines.append(f"# TYPE {prefix}_value gauge")
+        for name, value in summary["gauges"].items():
+            if isinstance(value, (int, float)):
+                lines.append(f'{prefix}_value{{name="{label_name(name)}"}} {value}')
+        lines.append(f"# TYPE {prefix}_rows_per_second gauge")
+        lines.append(f"{prefix}_rows_per_second {summary['rows_per_second']}")
+        lines.append(f"# TYPE {prefix}_wall_seconds gauge")
+        lines.append(f"{prefix}_wall_seconds {summary['wall_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path, prometheus_path=None):
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+
+
+# Metrics of the run in progress in this process
+METRICS = RunMetrics()
+
+# Set to a file path to also write the run metrics in the Prometheus text format
+# (e.g. for the node_exporter textfile collector)
+PROMETHEUS_FILE = os.environ.get("SMART_TRIAGE_METRICS_PROM")
@@ -0,0 +1,97 @@
+import time
+import logging
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+log = logging.getLogger(__name__)
+
+# ------------------------------
+# Downstream stages run after the case files are ingested
+# ------------------------------
+# A stage is one script; ``depends_on`` names the stages that must have finished
+# successfully before it starts, and ``use_env`` passes the run environment
+# (SMART_TRIAGE_LOG_FILE, SMART_TRIAGE_CASE_SNAPSHOT) through to it.
+Stage = namedtuple("Stage", ["name", "command", "depends_on", "use_env"], defaults=((), False))
+
+PIPELINE_STAGES = [
+    Stage("per_leave_update", ["python3", "per_leave_update.py"], (), True),
+    # SME assignment and time spent both read the leave data written above, but not each other's output
+    Stage("per_account_sme", ["python3", "per_account_sme.py"], ("per_leave_update",), True),
+    Stage("per_time_spent", ["python3", "per_time_spent.py"], ("per_leave_update",), True),
+    Stage("model", ["python3", "model.py"], ("per_leave_update", "per_account_sme", "per_time_spent"), True),
+]
+
+StageResult = namedtuple("StageResult", ["name", "ok", "seconds", "error"])
+
+
+class StageRunner:
+    """Runs the triggered stages of a DAG once each, independent ones concurrently.
+
+    ``trigger`` only records that a stage is wanted, so triggering the same stage
+    for every input file still runs it a single time in ``run``. Dependencies of a
+    triggered stage are ordered before it when they are triggered too; a stage
+    whose dependency failed (or was skipped) is skipped.
+    """
+
+    def __init__(self, stages=PIPELINE_STAGES, max_workers=None, env=None):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = set(stage.depends_on) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {sorted(unknown)}")
+        self.max_workers = max_workers or len(self.stages)
+        self.env = env
+        self._triggered = set()
+
+    def trigger(self, *names):
+        for name in names:
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'")
+            self._triggered.add(name)
+
+    def _execute(self, stage):
+        start = time.perf_counter()
+        try:
+            subprocess.run(stage.command, check=True, env=self.env if stage.use_env else None)
+            log.info(f"Called {' '.join(stage.command[1:])} successfully.")
+            return StageResult(stage.name, True, time.perf_counter() - start, None)
+        except (subprocess.CalledProcessError, OSError) as e:
+            log.error(f"Script failed: {e}")
+            return StageResult(stage.name, False, time.perf_counter() - start, str(e))
+
+    def run(self):
+        """Runs every triggered stage once; returns ``{name: StageResult}`` and clears the triggers."""
+        pending = {name: self.stages[name] for name in self.stages if name in self._triggered}
+        self._triggered = set()
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                scheduled = True
+                while scheduled:
+                    scheduled = False
+                    for name, stage in list(pending.items()):
+                        # Dependencies that were not triggered in this run do not hold a stage back
+                        deps = [dep for dep in stage.depends_on if dep in pending or dep in results or dep in running.values()]
+                        if any(dep in results and not results[dep].ok for dep in deps):
+                            log.warning(f"Skipping stage '{name}': a dependency failed")
+                            results[name] = StageResult(name, False, 0.0, "dependency failed")
+                        elif all(dep in results for dep in deps):
+                            running[pool.submit(self._execute, stage)] = name
+                        else:
+                            continue
+                        del pending[name]
+                        scheduled = True
+                if not running:
+                    if pending:
+                        raise ValueError(f"Stage dependency cycle among: {sorted(pending)}")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results[running.pop(future)] = result
+
+        for result in results.values():
+            log.info(f"Stage '{result.name}': {'ok' if result.ok else 'failed'} in {result.seconds:.2f}s")
+        return results
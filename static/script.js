@@ -1,5 +1,6 @@
 let currentSort = { column: "account", ascending: true };
 let cachedUsers = [];
+let lastSeq = null; // update_seq of cachedUsers; /users/changes returns what happened after it
 
 // -----------------------------
 // On Page Load
@@ -13,10 +14,38 @@ document.addEventListener("DOMContentLoaded", async () => {
 // Load & Render Functions
 // -----------------------------
 async function loadUsers(preserveSort = true) {
+  // The browser revalidates with the ETag, so an unchanged table comes back as a 304
   const res = await fetch("/users");
-  const data = await res.json();
-  cachedUsers = data;
+  cachedUsers = await res.json();
+  lastSeq = res.headers.get("X-Update-Seq");
+  renderUsers(preserveSort);
+}
 
+// Applies the mappings changed since the last load instead of fetching the whole table again
+async function refreshUsers(preserveSort = true) {
+  if (lastSeq === null) {
+    await loadUsers(preserveSort);
+    return;
+  }
+  const res = await fetch(`/users/changes?since=${encodeURIComponent(lastSeq)}`);
+  if (!res.ok) {
+    await loadUsers(preserveSort);
+    return;
+  }
+  const delta = await res.json();
+  const gone = new Set([
+    ...delta.deleted,
+    ...delta.changed.map((u) => u.id),
+  ]);
+  cachedUsers = cachedUsers
+    .filter((u) => !gone.has(u.id))
+    .concat(delta.changed);
+  lastSeq = delta.last_seq;
+  if (gone.size) renderUsers(preserveSort);
+}
+
+function renderUsers(preserveSort = true) {
+  const data = cachedUsers;
   const tbody = document.querySelector("#users_table tbody");
   tbody.innerHTML = "";
 
@@ -36,13 +65,13 @@ async function loadUsers(preserveSort = true) {
     const tr = document.createElement("tr");
     tr.innerHTML = `
       <td class="account-name-cell">${escapeHtml(row.user_name || "")}</td>
-      <td class="sf-name-cell" contenteditable="true" onblur="updateName('${row.id}', this.innerText)">
+      <td class="sf-name-cell" contenteditable="true" onblur="updateName('${escapeHtml(escapeJs(row.id))}', this.innerText)">
         ${escapeHtml(row.salesforce_name || "")}
       </td>
       <td>
         <div class="action-buttons">
-          <button class="bx--btn bx--btn--sm bx--btn--secondary" onclick="updateUser('${row.id}')">Update</button>
-          <button class="bx--btn bx--btn--sm bx--btn--danger" onclick="deleteUser('${row.id}')">Delete</button>
+          <button class="bx--btn bx--btn--sm bx--btn--secondary" onclick="updateUser('${escapeHtml(escapeJs(row.id))}')">Update</button>
+          <button class="bx--btn bx--btn--sm bx--btn--danger" onclick="deleteUser('${escapeHtml(escapeJs(row.id))}')">Delete</button>
         </div>
       </td>`;
     tbody.appendChild(tr);
@@ -143,13 +172,13 @@ async function addUser() {
 
   document.getElementById("salesforce_name").value = "";
   input.value = "";
-  await loadUsers(true); // Preserve sorting
+  await refreshUsers(true); // Preserve sorting
   showCarbonNotification("success", "Account Name saved");
 }
 
 async function updateUser(id) {
-  const res = await fetch("/users");
-  const users = await res.json();
+  await refreshUsers(true);
+  const users = cachedUsers;
   const row = users.find((u) => u.id === id);
   if (!row) return;
 
@@ -165,11 +194,11 @@ async function updateUser(id) {
       "error",
       "Alias (Salesforce) Account Name already exists"
     );
-    await loadUsers(true);
+    renderUsers(true);
     return;
   }
 
-  await fetch(`/users/${id}`, {
+  await fetch(`/users/${encodeURIComponent(id)}`, {
     method: "PUT",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({
@@ -177,14 +206,14 @@ async function updateUser(id) {
       salesforce_name: row.salesforce_name,
     }),
   });
-  await loadUsers(true);
+  await refreshUsers(true);
   showCarbonNotification("success", "Account updated");
 }
 
 async function deleteUser(id) {
   if (!confirm("Are you sure you want to delete this mapping?")) return;
-  await fetch(`/users/${id}`, { method: "DELETE" });
-  await loadUsers(true);
+  await fetch(`/users/${encodeURIComponent(id)}`, { method: "DELETE" });
+  await refreshUsers(true);
   showCarbonNotification("success", "Account deleted successfully");
 }
 
@@ -192,12 +221,12 @@ async function updateName(id, newName) {
   newName = (newName || "").trim();
   if (!newName) {
     showCarbonNotification("error", "Salesforce Name cannot be empty");
-    await loadUsers(true);
+    renderUsers(true);
     return;
   }
 
-  const res = await fetch("/users");
-  const users = await res.json();
+  await refreshUsers(true);
+  const users = cachedUsers;
 
   // Prevent duplicate alias names
   const duplicate = users.find(
@@ -211,14 +240,14 @@ async function updateName(id, newName) {
       "error",
       "Alias (Salesforce) Account Name already exists"
     );
-    await loadUsers(true);
+    renderUsers(true);
     return;
   }
 
   const row = users.find((u) => u.id === id);
   if (!row) return;
 
-  await fetch(`/users/${id}`, {
+  await fetch(`/users/${encodeURIComponent(id)}`, {
     method: "PUT",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({
@@ -227,7 +256,43 @@ async function updateName(id, newName) {
     }),
   });
 
-  await loadUsers(true);
+  await refreshUsers(true);
+}
+
+async function uploadMappings() {
+  const fileInput = document.getElementById("bulkFile");
+  const report = document.getElementById("bulkReport");
+  report.innerHTML = "";
+  if (!fileInput.files.length) {
+    showCarbonNotification("error", "Choose an .xlsx or .csv file to upload");
+    return;
+  }
+
+  const form = new FormData();
+  form.append("file", fileInput.files[0]);
+  const res = await fetch("/users/bulk", { method: "POST", body: form });
+  const data = await res.json();
+  if (!res.ok) {
+    showCarbonNotification("error", escapeHtml(data.error || "Upload failed"));
+    return;
+  }
+
+  // List only the rows that were not applied; the rest show up in the table
+  data.results
+    .filter((r) => !r.ok)
+    .forEach((r) => {
+      const li = document.createElement("li");
+      li.className = "bx--list__item";
+      li.textContent = `Row ${r.row}: ${r.user_name} -> ${r.salesforce_name}: ${r.reason || r.action}`;
+      report.appendChild(li);
+    });
+  fileInput.value = "";
+  await refreshUsers(true);
+  const failed = data.counts.failed || 0;
+  showCarbonNotification(
+    failed ? "warning" : "success",
+    `${data.rows} rows: ${data.rows - failed} applied, ${failed} not applied`
+  );
 }
 
 // -----------------------------
@@ -276,5 +341,5 @@ function escapeHtml(text) {
   });
 }
 function escapeJs(text) {
-  return ("" + text).replace(/'/g, "\\'");
+  return ("" + text).replace(/\\/g, "\\\\").replace(/'/g, "\\'");
 }
@@ -1,6 +1,5 @@
 import pandas as pd
-import time
-from Fetching_Primary_account import fetch_primary_name
+from Fetching_Primary_account import fetch_primary_names
 
 # Path to your Excel file
 INPUT_FILE = "AccountMapping.xlsx"
@@ -14,8 +13,10 @@ df = pd.read_excel(INPUT_FILE)
 if 'Salesforce Account Name' not in df.columns:
     raise KeyError("The Excel file must contain a column named 'salesforce account name'")
 
-# Loop through each alias and test fetch
-for alias_name in df['Salesforce Account Name']:
-    print(f"\n🔹 Testing alias: {alias_name}")
-    fetch_primary_name(alias_name)
-    time.sleep(0.5) 
+# Resolve the whole column in one go instead of one request per alias
+resolved, misses = fetch_primary_names(df['Salesforce Account Name'].dropna())
+for alias_name, primary_name in resolved.items():
+    print(f"🔹 Testing alias: {alias_name} -> ✅ {primary_name}")
+for alias_name in misses:
+    print(f"🔹 Testing alias: {alias_name} -> ⚠️ No matching alias found")
+print(f"\n✅ {len(resolved)} resolved, ⚠️ {len(misses)} without a primary name")